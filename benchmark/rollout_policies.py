@@ -0,0 +1,97 @@
+""" Solution quality per CPU-second of the rollout policies against uniformly random rollouts
+
+Every policy searches the same game for increasing CPU budgets. The best path found is completed
+with the same heuristic for every policy (nearest city first for the tourist, a known successor word
+for sentences), so that all policies are scored on full solutions. Every row shows evaluate_game() of the
+completed best path (the tour length in km for the tourist, lower is better, 1 for a human sentence) and
+its reward(), the value the search maximizes (higher is better for every game).
+
+Sentences are judged by the seeded StubSentenceClassifier of suite.py unless --classifier model loads the
+trained SentenceClassifier, whose model files are not part of the repository.
+
+    python benchmark/rollout_policies.py --game tsp --budgets 0.5 1 2
+    python benchmark/rollout_policies.py --game nlg --classifier stub --budgets 0.5 1 2
+"""
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from monte_carlo import MonteCarloTreeSearch  # noqa: E402
+from random_stream import RandomStream  # noqa: E402
+from rollout import BigramRollout, NearestNeighbourRollout, UniformRollout  # noqa: E402
+from traveling_tourist import TravelingTourist  # noqa: E402
+from tree import SearchTree  # noqa: E402
+
+CITIES = ["Berlin", "Lisbon", "Hamburg", "Madrid", "Oslo", "Rome", "Copenhagen", "Budapest", "Paris", "Vienna"]
+
+
+def make_tsp():
+    return TravelingTourist(possible_moves=list(CITIES), home_town="Berlin", current_game_state=["Berlin"])
+
+
+def make_nlg(classifier: str = "stub"):
+    """
+    :param classifier: "stub" judges sentences with StubSentenceClassifier, "model" loads the trained classifier
+    """
+    from nlg import NLGame
+    # suite imports complete() from this module
+    from suite import StubSentenceClassifier
+    vocabulary = ["the", "house", "tree", "is", "was", "big", "tall", "my", "name", "john", "a", "small", "green"]
+    sentence_classifier = StubSentenceClassifier(vocabulary, seed=0) if classifier == "stub" else None
+    return NLGame(vocabulary=vocabulary, current_game_state=["the"], starting_word="the",
+                  sentence_classifier=sentence_classifier)
+
+
+GAMES = {
+    "tsp": (make_tsp, {"uniform": UniformRollout, "nearest_neighbour": NearestNeighbourRollout},
+            lambda: NearestNeighbourRollout(epsilon=0.)),
+    "nlg": (make_nlg, {"uniform": UniformRollout, "bigram": BigramRollout},
+            lambda: BigramRollout(successor_weight=1e9)),
+}
+
+
+def complete(game, path, completion_policy, seed: int = 0):
+    """ Play path on a copy of game and finish it with completion_policy"""
+    game = game.clone()
+    rng = RandomStream(seed)
+    for move in path[len(game.current_game_state):]:
+        game.make_a_move(move)
+    while not game._check_game_over():
+        game.make_a_move(completion_policy.choose_move(game, game.generate_next_moves(), rng))
+    return game
+
+
+def run(game_name: str, budgets, seed: int, classifier: str = "stub"):
+    make_game, policies, make_completion_policy = GAMES[game_name]
+    if game_name == "nlg":
+        make_game = partial(make_game, classifier)
+    print("{:<20}{:>10}{:>12}{:>12}{:>14}{:>14}".format("policy", "budget", "cpu_seconds", "iterations", "evaluation",
+                                                        "reward"))
+    for policy_name, policy in policies.items():
+        for budget in budgets:
+            game = make_game()
+            search = MonteCarloTreeSearch(game_object=game, tree_object=SearchTree(), rollout_policy=policy(),
+                                          seed=seed)
+            start = time.process_time()
+            iterations = 0
+            while time.process_time() - start < budget:
+                iterations += search.search(max_iterations=16).iterations
+            cpu_seconds = time.process_time() - start
+            evaluation = complete(game, search.get_best_path(), make_completion_policy()).evaluate_game()
+            print("{:<20}{:>10.2f}{:>12.2f}{:>12}{:>14.2f}{:>14.2f}".format(policy_name, budget, cpu_seconds, iterations,
+                                                                             evaluation, game.reward(evaluation)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--game", choices=sorted(GAMES), default="tsp")
+    parser.add_argument("--budgets", type=float, nargs="+", default=[0.5, 1., 2.])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--classifier", choices=["stub", "model"], default="stub",
+                        help="sentence classifier of the nlg game")
+    args = parser.parse_args()
+    run(args.game, args.budgets, args.seed, args.classifier)
@@ -0,0 +1,291 @@
+""" Reproducible benchmark of MonteCarloTreeSearch throughput, memory and solution quality
+
+Runs a fixed number of seeded iterations on TravelingTourist instances of 5, 8, 12 and 20 cities and on
+NLGame with several vocabulary sizes, scored by an offline stub classifier. Every case reports
+iterations per second, nodes created, peak traced memory (tracemalloc, measured in a second run with the
+same seed so it does not slow down the timed run), peak RSS and the solution quality. Every case runs in a
+process of its own, peak RSS only grows within a process and would otherwise include the earlier cases.
+
+For the tourist, quality is the length of the best tour in km (the best path, completed nearest city
+first) against the optimum from Held-Karp, or against a 2-opt tour where Held-Karp is too slow.
+For sentences, quality is the fraction of known bigrams of the best sentence, the optimum is 1.
+
+    python benchmark/suite.py --output results.json
+    python benchmark/suite.py --output new.json --compare results.json
+
+--compare fails if iterations per second, peak traced memory or the solution quality of a case got worse
+by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from monte_carlo import MonteCarloTreeSearch  # noqa: E402
+from nlg import NLGame  # noqa: E402
+from rollout import BigramRollout, NearestNeighbourRollout  # noqa: E402
+from rollout_policies import complete  # noqa: E402
+from traveling_tourist import TravelingTourist  # noqa: E402
+from tree import ArrayTree, SearchTree  # noqa: E402
+
+CITIES = ["Berlin", "Paris", "Lisbon", "Madrid", "Rome", "Vienna", "Amsterdam", "Copenhagen", "Oslo", "Budapest",
+          "Athens", "London", "Dublin", "Brussels", "Zurich", "Belgrade", "Bucharest", "Prague", "Cologne",
+          "Hamburg"]
+TSP_SIZES = [5, 8, 12, 20]
+VOCABULARY_SIZES = [50, 200, 1000]
+# largest instance solved exactly, Held-Karp needs 2^(n-1) * (n-1)^2 steps
+HELD_KARP_MAX_CITIES = 13
+TREES = {"search": SearchTree, "array": ArrayTree}
+# metrics checked by --compare, and whether higher values are better
+COMPARED_METRICS = {"iterations_per_second": True, "peak_tracemalloc_bytes": False, "ratio_to_reference": False,
+                    "known_bigram_fraction": True}
+
+
+class StubSentenceClassifier(object):
+    """ Offline stand-in for SentenceClassifier: a sentence is human if enough of its bigrams are known
+
+    Every word gets a few random known successors, drawn from a seeded generator.
+    """
+
+    def __init__(self, vocabulary: List[str], seed: int, successors_per_word: int = 5,
+                 acceptance_threshold: float = 0.5):
+        rng = random.Random(seed)
+        self.known_bigrams = {(word, successor) for word in vocabulary
+                              for successor in rng.sample(vocabulary, min(successors_per_word, len(vocabulary)))}
+        self.acceptance_threshold = acceptance_threshold
+
+    def score(self, word_sequence: List[str]) -> float:
+        bigrams = list(zip(word_sequence, word_sequence[1:]))
+        return sum(bigram in self.known_bigrams for bigram in bigrams) / max(len(bigrams), 1)
+
+    def sentence_is_human(self, word_sequence: List[str]) -> bool:
+        return self.score(word_sequence) >= self.acceptance_threshold
+
+    def sentences_are_human(self, word_sequences: List[List[str]]) -> List[bool]:
+        return [self.sentence_is_human(word_sequence) for word_sequence in word_sequences]
+
+
+def distance_matrix(game: TravelingTourist, cities: List[str]) -> np.ndarray:
+    distances = np.zeros((len(cities), len(cities)))
+    for i, j in combinations(range(len(cities)), 2):
+        distances[i, j] = distances[j, i] = game.city_grid.distance_between_two_cities(cities[i], cities[j])
+    return distances
+
+
+def tour_length(distances: np.ndarray, tour: List[int]) -> float:
+    return float(sum(distances[a, b] for a, b in zip(tour, tour[1:])))
+
+
+def held_karp(distances: np.ndarray) -> float:
+    """ Length of the shortest round trip starting and ending at city 0"""
+    n = len(distances)
+    # best[(subset, last)]: shortest path from 0 through all cities of subset (bitmask over 1..n-1) ending in last
+    best = {(1 << k, k): distances[0, k] for k in range(1, n)}
+    for size in range(2, n):
+        for subset in combinations(range(1, n), size):
+            mask = sum(1 << k for k in subset)
+            for last in subset:
+                previous = mask & ~(1 << last)
+                best[(mask, last)] = min(best[(previous, k)] + distances[k, last] for k in subset if k != last)
+    full = (1 << n) - 2
+    return float(min(best[(full, k)] + distances[k, 0] for k in range(1, n)))
+
+
+def two_opt(distances: np.ndarray) -> float:
+    """ Length of a nearest neighbour round trip from city 0 improved with 2-opt until no move helps"""
+    n = len(distances)
+    tour = [0]
+    while len(tour) < n:
+        remaining = [k for k in range(n) if k not in tour]
+        tour.append(min(remaining, key=lambda k: distances[tour[-1], k]))
+    tour.append(0)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                gain = (distances[tour[i - 1], tour[i]] + distances[tour[j], tour[j + 1]]
+                        - distances[tour[i - 1], tour[j]] - distances[tour[i], tour[j + 1]])
+                if gain > 1e-9:
+                    tour[i:j + 1] = tour[i:j + 1][::-1]
+                    improved = True
+    return tour_length(distances, tour)
+
+
+def make_tsp_case(n_cities: int):
+    cities = CITIES[:n_cities]
+
+    def make_game():
+        return TravelingTourist(possible_moves=cities[1:] + cities[:1], home_town=cities[0],
+                                current_game_state=[cities[0]])
+
+    def quality(game, best_path) -> Dict:
+        distances = distance_matrix(game, cities)
+        if n_cities <= HELD_KARP_MAX_CITIES:
+            reference, reference_method = held_karp(distances), "held_karp"
+        else:
+            reference, reference_method = two_opt(distances), "2-opt"
+        tour = complete(game, best_path, NearestNeighbourRollout(epsilon=0.)).current_game_state
+        best_tour_km = tour_length(distances, [cities.index(city) for city in tour])
+        return {"best_tour_km": best_tour_km, "reference_km": reference, "reference_method": reference_method,
+                "ratio_to_reference": best_tour_km / reference}
+
+    return "tsp_{n}".format(n=n_cities), make_game, quality
+
+
+def make_nlg_case(vocabulary_size: int, seed: int):
+    vocabulary = ["w{index:05d}".format(index=index) for index in range(vocabulary_size)]
+    classifier = StubSentenceClassifier(vocabulary, seed)
+
+    def make_game():
+        return NLGame(vocabulary=vocabulary, current_game_state=[vocabulary[0]], starting_word=vocabulary[0],
+                      sentence_classifier=classifier)
+
+    def quality(game, best_path) -> Dict:
+        sentence = complete(game, best_path, BigramRollout(successor_weight=1e9)).current_game_state
+        return {"best_sentence": sentence, "known_bigram_fraction": classifier.score(sentence), "reference": 1.}
+
+    return "nlg_{n}".format(n=vocabulary_size), make_game, quality
+
+
+def make_case(name: str, seed: int):
+    kind, size = name.split("_")
+    return make_tsp_case(int(size)) if kind == "tsp" else make_nlg_case(int(size), seed)
+
+
+def run_search(make_game, tree_class, iterations: int, seed: int) -> Tuple[MonteCarloTreeSearch, float]:
+    game = make_game()
+    search = MonteCarloTreeSearch(game_object=game, tree_object=tree_class(), seed=seed)
+    start = time.perf_counter()
+    search.make_iteration(iterations)
+    return search, time.perf_counter() - start
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def run_case(name: str, tree_name: str, iterations: int, seed: int) -> Dict:
+    _, make_game, quality = make_case(name, seed)
+    tree_class = TREES[tree_name]
+    search, elapsed = run_search(make_game, tree_class, iterations, seed)
+    tracemalloc.start()
+    run_search(make_game, tree_class, iterations, seed)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"case": name,
+              "tree": tree_name,
+              "iterations": iterations,
+              "seconds": elapsed,
+              "iterations_per_second": iterations / elapsed,
+              "nodes_created": search.search_tree.node_count,
+              "peak_tracemalloc_bytes": peak_traced,
+              "peak_rss_bytes": peak_rss_bytes()}
+    result.update(quality(search.game_master, search.get_best_path()))
+    return result
+
+
+def run_case_in_subprocess(name: str, tree_name: str, iterations: int, seed: int) -> Dict:
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run-case", name, tree_name,
+                                      "--iterations", str(iterations), "--seed", str(seed)])
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """ Metrics of cases that got worse by more than tolerance (a fraction) against baseline"""
+    baseline = {(result["case"], result["tree"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get((result["case"], result["tree"]))
+        if old is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in result or not old.get(metric):
+                continue
+            ratio = result[metric] / old[metric]
+            print("{case:<12}{tree:<8}{metric:<24}{old:>14.4g} -> {new:>14.4g} ({ratio:+.1%})".format(
+                case=result["case"], tree=result["tree"], metric=metric, old=old[metric], new=result[metric],
+                ratio=ratio - 1))
+            if (ratio < 1 - tolerance) if higher_is_better else (ratio > 1 + tolerance):
+                regressions.append("{case} {tree} {metric}".format(case=result["case"], tree=result["tree"],
+                                                                 metric=metric))
+    return regressions
+
+
+def main(args) -> int:
+    if args.run_case is not None:
+        name, tree_name = args.run_case
+        print(json.dumps(run_case(name, tree_name, args.iterations, args.seed)))
+        return 0
+    names = ["tsp_{n}".format(n=n) for n in args.tsp_sizes] + ["nlg_{n}".format(n=n) for n in args.vocabulary_sizes]
+    results = []
+    for name in names:
+        for tree_name in args.trees:
+            result = run_case_in_subprocess(name, tree_name, args.iterations, args.seed)
+            print("{case:<12}{tree:<8}{ips:>12.1f} iterations/s {nodes:>8} nodes {memory:>10.1f} MiB traced"
+                  "{rss:>10.1f} MiB RSS".format(case=name, tree=tree_name, ips=result["iterations_per_second"],
+                                                nodes=result["nodes_created"],
+                                                memory=result["peak_tracemalloc_bytes"] / 2 ** 20,
+                                                rss=(result["peak_rss_bytes"] or 0) / 2 ** 20))
+            results.append(result)
+    report = {"commit": git_commit(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "seed": args.seed,
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.compare is None:
+        return 0
+    with open(args.compare) as f:
+        regressions = compare(results, json.load(f)["results"], args.tolerance)
+    if len(regressions):
+        print("Regressions: {cases}".format(cases=", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier output to compare speed, memory and quality against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change for the worse reported as regression by --compare")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tsp-sizes", type=int, nargs="*", default=TSP_SIZES)
+    parser.add_argument("--vocabulary-sizes", type=int, nargs="*", default=VOCABULARY_SIZES)
+    parser.add_argument("--trees", nargs="+", choices=sorted(TREES), default=["search", "array"])
+    parser.add_argument("--run-case", nargs=2, metavar=("CASE", "TREE"),
+                        help="run a single case and print its result as JSON, used for the process per case")
+    sys.exit(main(parser.parse_args()))
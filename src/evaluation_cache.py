@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+
+class EvaluationCache(object):
+    """ Least recently used cache of terminal-state evaluations
+
+    Keys are the game's terminal_key(), so a finished game that was already evaluated is not scored again.
+    Safe to share between the workers of a tree-parallel search.
+    """
+    missing = object()
+
+    def __init__(self, max_size: int = 100000):
+        """
+        :param max_size: number of evaluations kept, the least recently used one is dropped beyond that
+        """
+        if max_size < 1:
+            raise ValueError("max_size needs to be at least 1.")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._evaluations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._evaluations)
+
+    def __contains__(self, key: Hashable):
+        return key in self._evaluations
+
+    def get(self, key: Hashable):
+        """ Cached evaluation of key or EvaluationCache.missing, counts as hit or miss"""
+        with self._lock:
+            evaluation = self._evaluations.get(key, self.missing)
+            if evaluation is self.missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._evaluations.move_to_end(key)
+            return evaluation
+
+    def put(self, key: Hashable, evaluation):
+        with self._lock:
+            self._evaluations[key] = evaluation
+            self._evaluations.move_to_end(key)
+            if len(self._evaluations) > self.max_size:
+                self._evaluations.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def clear(self):
+        with self._lock:
+            self._evaluations.clear()
+            self.hits = 0
+            self.misses = 0
@@ -1,3 +1,6 @@
+from typing import Iterator, List
+
+
 class MoveNotAllowedError(LookupError):
     pass
 
@@ -49,6 +52,14 @@ class Game(object):
         """ Make a move if possible"""
         raise NotImplementedError
 
+    def undo_move(self):
+        """ Revert the last move made with make_a_move"""
+        raise NotImplementedError
+
+    def clone(self):
+        """ Copy the mutable game state, immutable resources are shared with the clone"""
+        raise NotImplementedError
+
     def generate_next_moves(self):
         raise NotImplementedError
 
@@ -59,3 +70,50 @@ class Game(object):
     def evaluate_game(self):
         """ """
         raise NotImplementedError
+
+    def state_key(self):
+        """ Hashable key that is equal for all move sequences leading to the same game state"""
+        raise NotImplementedError
+
+    def terminal_key(self):
+        """ Hashable key that is equal for all finished games with the same evaluation"""
+        raise NotImplementedError
+
+    def order_moves(self, moves: List) -> List:
+        """ Moves sorted by how promising they look, most promising first
+
+        Progressive widening adds children in this order. Games without a prior keep the order of generate_next_moves.
+        """
+        return moves
+
+    def widening_order(self) -> Iterator:
+        """ Legal moves of the current state in the order of order_moves(), produced lazily
+
+        Progressive widening keeps one of these iterators per node and only takes as many moves as it adds
+        children, so games with many moves override this to walk a shared ordering instead of building and
+        sorting a list per state. The iterator must not depend on later changes of the game.
+        """
+        return iter(self.order_moves(self.generate_next_moves()))
+
+    def rollout_batch(self, n_rollouts: int, rng) -> List:
+        """ Evaluations of n_rollouts uniformly random completions of the current game
+
+        Games that can play many rollouts with array operations implement this,
+        see MonteCarloTreeSearch(batch_rollouts=True).
+        :param rng: RandomStream of the search
+        """
+        raise NotImplementedError
+
+    def reward(self, evaluation) -> float:
+        """ Value the search maximizes for the evaluation of a terminated game
+
+        Games whose evaluations are better when lower (e.g. costs) override this, the default is the evaluation itself.
+        """
+        return evaluation
+
+    def evaluate_games(self, states: List["Game"]) -> List:
+        """ Evaluate several terminated games at once
+
+        Games with an evaluator that is expensive to call can override this to score all states in one batch.
+        """
+        return [state.evaluate_game() for state in states]
@@ -0,0 +1,92 @@
+import json
+from bisect import bisect_left
+from typing import Callable, Dict, List
+
+
+class SearchInstrumentation(object):
+    """ Timings and counters of the search loop of MonteCarloTreeSearch
+
+    Pass an instance as instrumentation to MonteCarloTreeSearch. Every iteration then records the time spent
+    per phase (cumulative and as a histogram), the nodes created, the rollout depth and the tree size.
+    Without instrumentation the search loop takes no timings at all.
+    Tree-parallel iterations (workers > 1) are not recorded.
+    """
+    phases = ("select", "expand", "simulate", "evaluate", "backpropagate")
+    # upper bounds of the histogram buckets in seconds, from 1 microsecond to 10 seconds, plus one overflow bucket
+    histogram_bounds = [10 ** (exponent / 2) for exponent in range(-12, 3)]
+
+    def __init__(self, callback: Callable[[Dict], None] = None, callback_interval: int = 100):
+        """
+        :param callback: called with snapshot() every callback_interval iterations
+        :param callback_interval: number of iterations between two callback calls
+        """
+        self.callback = callback
+        self.callback_interval = callback_interval
+        self.reset()
+
+    def reset(self):
+        self.phase_seconds = {phase: 0. for phase in self.phases}
+        self.phase_counts = {phase: 0 for phase in self.phases}
+        self.phase_histograms = {phase: [0] * (len(self.histogram_bounds) + 1) for phase in self.phases}
+        self.iterations = 0
+        self.nodes_created = 0
+        self.rollouts = 0
+        self.rollout_moves = 0
+        self.max_rollout_depth = 0
+        self.tree_size = 0
+        self.started = None
+        self.last_iteration_end = None
+
+    def record_phase(self, phase: str, seconds: float):
+        self.phase_seconds[phase] += seconds
+        self.phase_counts[phase] += 1
+        self.phase_histograms[phase][bisect_left(self.histogram_bounds, seconds)] += 1
+
+    def record_rollouts(self, depths: List[int]):
+        """ :param depths: number of moves played by every rollout of the iteration"""
+        self.rollouts += len(depths)
+        self.rollout_moves += sum(depths)
+        self.max_rollout_depth = max([self.max_rollout_depth] + depths)
+
+    def record_iteration(self, started: float, ended: float, nodes_created: int, tree_size: int):
+        """
+        :param started: time.perf_counter() at the start of the iteration
+        :param ended: time.perf_counter() at the end of the iteration
+        """
+        if self.started is None:
+            self.started = started
+        self.last_iteration_end = ended
+        self.iterations += 1
+        self.nodes_created += nodes_created
+        self.tree_size = tree_size
+        if self.callback is not None and self.iterations % self.callback_interval == 0:
+            self.callback(self.snapshot())
+
+    @property
+    def iterations_per_second(self) -> float:
+        if self.started is None or self.last_iteration_end == self.started:
+            return 0.
+        return self.iterations / (self.last_iteration_end - self.started)
+
+    def snapshot(self) -> Dict:
+        """ All counters as a JSON serializable dict"""
+        phases = {}
+        for phase in self.phases:
+            count = self.phase_counts[phase]
+            phases[phase] = {"total_seconds": self.phase_seconds[phase],
+                             "count": count,
+                             "mean_seconds": self.phase_seconds[phase] / count if count else 0.,
+                             "histogram": list(self.phase_histograms[phase])}
+        return {"iterations": self.iterations,
+                "iterations_per_second": self.iterations_per_second,
+                "nodes_created": self.nodes_created,
+                "tree_size": self.tree_size,
+                "rollouts": self.rollouts,
+                "mean_rollout_depth": self.rollout_moves / self.rollouts if self.rollouts else 0.,
+                "max_rollout_depth": self.max_rollout_depth,
+                "histogram_bounds_seconds": list(self.histogram_bounds),
+                "phases": phases}
+
+    def to_json(self, **kwargs) -> str:
+        """ snapshot() as JSON, kwargs are passed on to json.dumps"""
+        return json.dumps(self.snapshot(), **kwargs)
@@ -1,137 +1,644 @@
+import asyncio
 import math
-import random
-from copy import deepcopy
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from copy import copy
+from typing import AsyncIterator, Iterator, List, NamedTuple, Tuple, Union
 
-from numpy.random import choice
+import numpy as np
 
+from evaluation_cache import EvaluationCache
+from instrumentation import SearchInstrumentation
 from nlg import NLGame
-from tree import SearchTree
+from random_stream import RandomStream
+from rollout import RolloutPolicy, UniformRollout
+from tree import SearchTree, ArrayTree
+
+
+class SearchResult(NamedTuple):
+    best_path: List[str]
+    iterations: int
+    elapsed: float
+    stop_reason: str
+
+
+class WideningCursor(object):
+    """ Moves of one node in widening order, taken from Game.widening_order() only as far as they are needed"""
+    __slots__ = ("moves", "upcoming")
+
+    def __init__(self, moves: Iterator):
+        self.moves = moves
+        # moves taken from the iterator that have no child yet
+        self.upcoming = []
+
+    def untried(self, node, n: int) -> List:
+        """ The next n moves (fewer once the moves run out) that are not children of node"""
+        self.upcoming = [move for move in self.upcoming if move not in node]
+        while len(self.upcoming) < n:
+            move = next(self.moves, self)
+            if move is self:
+                break
+            if move not in node:
+                self.upcoming.append(move)
+        return self.upcoming[:n]
 
 
 class MonteCarloTreeSearch(object):
-    def __init__(self, game_object, tree_object: SearchTree):
+    unvisited_upper_confidence_bound = 99 ** 10
+    lock_stripes = {"tree": 1, "node": 64}
+
+    def __init__(self, game_object, tree_object: Union[SearchTree, ArrayTree], vectorized_selection: bool = False,
+                 greedy_selection: bool = False, rollouts_per_leaf: int = 1, transpositions: bool = False,
+                 progressive_widening: bool = False, widening_coefficient: float = 1., widening_exponent: float = 0.5,
+                 rollout_policy: RolloutPolicy = None, instrumentation: SearchInstrumentation = None,
+                 seed: int = None, evaluation_cache: EvaluationCache = None, batch_rollouts: bool = False):
+        """ The search maximizes game_object.reward() of the evaluations of finished games
+
+        :param vectorized_selection: Score all children of a node with one NumPy expression in select(). Only an
+        ArrayTree keeps the child statistics in arrays, so this requires tree_object to be one and raises ValueError
+        for a SearchTree, whose children would still be gathered one by one in Python.
+        :param greedy_selection: Follow the child with the highest upper confidence bound instead of sampling
+        proportionally to it
+        :param rollouts_per_leaf: Rollouts run after every expansion, more than one evaluates all of them with a
+        single game.evaluate_games call and backpropagates them together
+        :param transpositions: Share one node between all paths leading to the same game state, as identified by
+        game_object.state_key(). This turns the tree into a directed acyclic graph.
+        :param progressive_widening: A node visited n times only gets widening_coefficient * n ** widening_exponent
+        children (at least one), added in the order of game_object.order_moves(). Memory then grows with the
+        number of visits instead of the branching factor.
+        :param rollout_policy: Chooses the moves of every simulation, uniformly random moves if None
+        :param instrumentation: Records phase timings and counters of every iteration, nothing is recorded if None
+        :param seed: Seed of the random stream owned by this search, None seeds from the operating system
+        :param evaluation_cache: Reuse evaluations of finished games with the same game.terminal_key()
+        :param batch_rollouts: Play and score all rollouts_per_leaf rollouts at once with game_object.rollout_batch(),
+        which plays uniformly random moves and scores them itself. Raises ValueError together with a rollout_policy
+        other than UniformRollout, with an evaluation_cache or with a game restricted to candidate_neighbours.
+        """
         self.game_master = game_object
-        self.current_game = deepcopy(game_object)
-        self.current_path = [self.game_master.root]
+        self.current_game = game_object.clone()
+        self.root_move = self.game_master.root
+        self.committed_path = [self.game_master.root]
+        self.current_path = [self.root_move]
+        # tree nodes along current_path, kept so that backpropagation does not walk the tree again
+        self.current_nodes = []
         self.search_tree = tree_object
         self.upc_coefficient = 1000
         self.total_simulations_run = 0
+        self.vectorized_selection = vectorized_selection
+        self.greedy_selection = greedy_selection
+        self.rollouts_per_leaf = rollouts_per_leaf
+        self.transpositions = transpositions
+        self.transposition_table = {}
+        self.progressive_widening = progressive_widening
+        # node_id -> WideningCursor of the node, the moves are ordered once instead of on every visit
+        self.widening_cursors = {}
+        self.widening_coefficient = widening_coefficient
+        self.widening_exponent = widening_exponent
+        self.rollout_policy = UniformRollout() if rollout_policy is None else rollout_policy
+        self.instrumentation = instrumentation
+        self.rng = RandomStream(seed)
+        self.evaluation_cache = evaluation_cache
+        self.batch_rollouts = batch_rollouts
+        if vectorized_selection and not tree_object.columnar_statistics:
+            raise ValueError("vectorized_selection reads the child statistics as arrays, it requires an ArrayTree.")
+        if batch_rollouts and not isinstance(self.rollout_policy, UniformRollout):
+            raise ValueError("batch_rollouts play uniformly random moves, they cannot use a rollout_policy.")
+        if batch_rollouts and evaluation_cache is not None:
+            raise ValueError("batch_rollouts are scored by the game, they cannot use an evaluation_cache.")
+        if batch_rollouts and getattr(game_object, "candidate_neighbours", None) is not None:
+            raise ValueError("batch_rollouts play every legal move, they cannot use a game's candidate_neighbours.")
 
-    def compute_upper_confidence_bound(self, average_value: float, n_simul_node: int) -> float:
+    def compute_upper_confidence_bound(self, average_value: float, n_simul_node: int,
+                                       parent_passes: int = None) -> float:
+        """
+        :param parent_passes: visits of the node whose child is scored, total_simulations_run if None
+        """
         if n_simul_node == 0:
-            return 99 ** 10
-        value = average_value + self.upc_coefficient * math.sqrt((math.log(self.total_simulations_run) / n_simul_node))
-        if value == 0:
-            # TODO: dirty fix?
-            value += 0.01
+            return self.unvisited_upper_confidence_bound
+        simulations = self.total_simulations_run if parent_passes is None else parent_passes
+        value = average_value + self.upc_coefficient * math.sqrt((math.log(max(simulations, 1)) / n_simul_node))
+        if value <= 0:
+            # selection samples proportionally to the bound, which needs positive values
+            # (averages can drop below zero while a virtual loss is applied)
+            value = 0.01
         return value
 
-    @staticmethod
-    def _weighted_random_choice(choices: List[str], probability_vector: List[float]) -> str:
-        return choice(choices, 1, p=probability_vector)[0]
+    def compute_upper_confidence_bounds(self, average_values: np.ndarray, n_simul_nodes: np.ndarray,
+                                        parent_passes: int = None) -> np.ndarray:
+        """ Vectorized compute_upper_confidence_bound for all children of a node"""
+        visited = n_simul_nodes > 0
+        values = np.full(len(n_simul_nodes), float(self.unvisited_upper_confidence_bound))
+        if visited.any():
+            simulations = self.total_simulations_run if parent_passes is None else parent_passes
+            exploration = np.sqrt(math.log(max(simulations, 1)) / n_simul_nodes[visited])
+            values[visited] = average_values[visited] + self.upc_coefficient * exploration
+        values[values <= 0] = 0.01
+        return values
+
+    def _weighted_random_choice(self, choices: List[str], probability_vector: List[float]) -> str:
+        return self.rng.weighted_choice(choices, probability_vector)
+
+    def _choose_child(self, branch, parent_passes: int = None) -> str:
+        # statistics of all children in one pass, looking up every child by its move costs a search on an ArrayTree
+        moves = list(branch.keys())
+        passes, averages = branch.child_statistics()
+        children_ucb = [self.compute_upper_confidence_bound(average_value=average, n_simul_node=n_simul_node,
+                                                            parent_passes=parent_passes)
+                        for n_simul_node, average in zip(passes.tolist(), averages.tolist())]
+        if self.greedy_selection:
+            return moves[children_ucb.index(max(children_ucb))]
+        sum_ucb = sum(children_ucb)
+        return self._weighted_random_choice(moves, [value / sum_ucb for value in children_ucb])
+
+    def _choose_child_vectorized(self, branch, parent_passes: int = None) -> str:
+        passes, averages = branch.child_statistics()
+        children_ucb = self.compute_upper_confidence_bounds(average_values=averages, n_simul_nodes=passes,
+                                                            parent_passes=parent_passes)
+        if self.greedy_selection:
+            return branch.child_move(int(np.argmax(children_ucb)))
+        return branch.child_move(self.rng.weighted_index(children_ucb))
+
+    def _widening_limit(self, passes: int) -> int:
+        return max(1, int(self.widening_coefficient * passes ** self.widening_exponent))
+
+    def _widening_cursor(self, node) -> WideningCursor:
+        """ Cursor over the moves of node, which current_game has reached, in the order progressive widening adds them"""
+        cursor = self.widening_cursors.get(node.node_id)
+        if cursor is None:
+            cursor = WideningCursor(self.current_game.widening_order())
+            self.widening_cursors[node.node_id] = cursor
+        return cursor
+
+    def _can_widen(self, branch) -> bool:
+        """ With progressive widening, whether branch gets another child instead of selecting one of its children"""
+        if not self.progressive_widening or len(branch) >= self._widening_limit(branch.passes):
+            return False
+        return len(self._widening_cursor(branch).untried(branch, 1)) > 0
+
+    def _moves_to_add(self, leaf) -> List[str]:
+        """ Moves that get a node when leaf is expanded, all legal moves without progressive widening"""
+        if not self.progressive_widening:
+            return self.current_game.generate_next_moves()
+        return self._widening_cursor(leaf).untried(leaf, max(self._widening_limit(leaf.passes) - len(leaf), 1))
+
+    def _rewind(self):
+        """ Undo the moves of the last iteration on the working game instead of copying game_master again"""
+        while len(self.current_path) > 1:
+            self.current_game.undo_move()
+            self.current_path.pop()
 
     def select(self):
-        self.current_game = deepcopy(self.game_master)
-        self.current_path = [self.game_master.root]
-        branch = self.search_tree[self.game_master.root]
-        children_ucb = {k: self.compute_upper_confidence_bound(average_value=branch[k].average_path_value, n_simul_node=branch[k].passes) for k in branch.keys()}
-        sum_ucb = sum(children_ucb.values())
-        children_probs = {k: v / sum_ucb for k, v in children_ucb.items()}
-
-        while len(children_probs.keys()) and self.current_game._check_game_over() is False:
-            chosen = self._weighted_random_choice(list(children_probs.keys()), list(children_probs.values()))
-            self.current_path.append(chosen)
+        self._rewind()
+        branch = self.search_tree[self.root_move]
+        self.current_nodes = [branch]
+        choose_child = self._choose_child_vectorized if self.vectorized_selection else self._choose_child
+
+        while len(branch) and self.current_game._check_game_over() is False and not self._can_widen(branch):
+            chosen = choose_child(branch)
             self.current_game.make_a_move(chosen)
+            self.current_path.append(chosen)
             branch = branch[chosen]
-            if isinstance(branch, dict):
-                children_ucb = {k: self.compute_upper_confidence_bound(average_value=branch[k].average_path_value, n_simul_node=branch[k].passes) for k in branch.keys() if isinstance(k, str)}
-                sum_ucb = sum(children_ucb.values())
-                children_probs = {k: v / sum_ucb for k, v in children_ucb.items()}
-            else:
-                break
+            self.current_nodes.append(branch)
         return self.current_path
 
-    def _expand_tree(self, child):
-        path_to_expand = self.current_path + [child]
-        current_leaf = self.search_tree
-        for next_leaf in path_to_expand:
-            current_leaf = current_leaf[next_leaf]
+    def _add_children(self, leaf, children: List[str]):
+        """ Create the nodes for children below leaf
+
+        With transpositions, a child whose game state is already in the tree is linked to the existing node
+        instead of getting a node of its own.
+        """
+        if not self.transpositions:
+            leaf.add_children(children)
+            return
+        for child in children:
+            if child in leaf:
+                continue
+            self.current_game.make_a_move(child)
+            state_key = self.current_game.state_key()
+            self.current_game.undo_move()
+            if state_key in self.transposition_table:
+                leaf.link(child, self.transposition_table[state_key])
+            else:
+                self.transposition_table[state_key] = leaf[child]
 
     def expand(self):
         # Retrieve possible children
-        children = self.current_game.generate_next_moves()
+        leaf = self.current_nodes[-1]
+        children = self._moves_to_add(leaf)
         if not len(children):
             return False
-        for child in children:
-            self._expand_tree(child)
+        self._add_children(leaf, children)
         # Randomly choose one of them
-        expansion_child = random.choice(children)
+        expansion_child = self.rng.choice(children)
         # Make move
         self.current_game.make_a_move(expansion_child)
         self.current_path.append(expansion_child)
+        self.current_nodes.append(leaf[expansion_child])
 
         return self.current_path
 
-    def simulate(self):
-        simulated_game = deepcopy(self.current_game)
-        simulated_path = deepcopy(self.current_path)
+    def _rollout(self):
+        """ Play from the current game with the rollout policy until it is over
+
+        :return: the terminated copy of the game
+        """
+        simulated_game = self.current_game.clone()
         while simulated_game._check_game_over() is False:
             # Retrieve possible children
             children = simulated_game.generate_next_moves()
             if not len(children):
                 raise Exception("No children left")
-            # Randomly choose one of them
-            expansion_child = random.choice(children)
+            # Let the rollout policy choose one of them
+            expansion_child = self.rollout_policy.choose_move(simulated_game, children, self.rng)
             # Make move
             simulated_game.make_a_move(expansion_child)
-            simulated_path.append(expansion_child)
-        evaluation = simulated_game.evaluate_game()
-        # print("simulated evaluation", simulated_game.sentence_classifier.log)
-        self.total_simulations_run += 1
-        return evaluation
+        return simulated_game
+
+    def simulate(self):
+        return self._evaluate_rollouts([self._rollout()])[0]
+
+    def simulate_batch(self, n_rollouts: int) -> List:
+        """ Run n_rollouts rollouts from the current game and evaluate them with one evaluate_games call"""
+        return self._evaluate_rollouts([self._rollout() for _ in range(n_rollouts)])
+
+    def _rollout_batch(self, n_rollouts: int) -> List:
+        """ Evaluations of n_rollouts rollouts played by the game itself with array operations"""
+        evaluations = list(self.current_game.rollout_batch(n_rollouts, self.rng))
+        self.total_simulations_run += n_rollouts
+        return evaluations
+
+    def _evaluate_rollouts(self, simulated_games: List) -> List:
+        if self.evaluation_cache is None:
+            evaluations = self._evaluate_games(simulated_games)
+        else:
+            evaluations = self._evaluate_games_cached(simulated_games)
+        self.total_simulations_run += len(simulated_games)
+        return evaluations
+
+    def _evaluate_games(self, games: List) -> List:
+        if len(games) == 1:
+            return [games[0].evaluate_game()]
+        return self.current_game.evaluate_games(games)
+
+    def _evaluate_games_cached(self, games: List) -> List:
+        """ Look up every game in the evaluation cache and evaluate the misses at once, each distinct one once"""
+        keys = [game.terminal_key() for game in games]
+        evaluations = [self.evaluation_cache.get(key) for key in keys]
+        misses = {}
+        for i, evaluation in enumerate(evaluations):
+            if evaluation is EvaluationCache.missing:
+                misses.setdefault(keys[i], i)
+        if len(misses):
+            new_evaluations = dict(zip(misses, self._evaluate_games([games[i] for i in misses.values()])))
+            for key, evaluation in new_evaluations.items():
+                self.evaluation_cache.put(key, evaluation)
+            evaluations = [new_evaluations[key] if evaluation is EvaluationCache.missing else evaluation
+                           for key, evaluation in zip(keys, evaluations)]
+        return evaluations
+
+    def _summarize(self, evaluations: List):
+        """ :return: number of usable evaluations, the sum of their rewards and the sum of squared rewards"""
+        rewards = [self.current_game.reward(evaluation) for evaluation in evaluations
+                   if isinstance(evaluation, (int, float))]
+        return len(rewards), sum(rewards), sum(reward * reward for reward in rewards)
+
+    def _evaluate_leaf(self):
+        """ Simulate from the current leaf
+
+        :return: number of usable evaluations, their sum and their sum of squares
+        """
+        if self.batch_rollouts:
+            evaluations = self._rollout_batch(self.rollouts_per_leaf)
+        elif self.rollouts_per_leaf == 1:
+            evaluations = [self.simulate()]
+        else:
+            evaluations = self.simulate_batch(self.rollouts_per_leaf)
+        return self._summarize(evaluations)
 
     def backpropagate(self, simulation_evaluation):
-        current_child = self.search_tree
-        for next_child in self.current_path:
-            current_child = current_child[next_child]
-            current_child.passes += 1
-            if current_child.passes == 1:
-                current_child.average_path_value = simulation_evaluation
-            else:
-                assert current_child != 0
-                current_child.average_path_value = ((current_child.passes - 1) * current_child.average_path_value + simulation_evaluation) / (current_child.passes)
+        for node in self.current_nodes:
+            node.update(simulation_evaluation)
 
-    def make_iteration(self, n=1):
-        for i in range(n):
+    def backpropagate_batch(self, n_simulations: int, evaluation_sum: float, sum_of_squares: float = 0.):
+        """ Add several simulations of the current path at once"""
+        for node in self.current_nodes:
+            node.merge(n_simulations, evaluation_sum, sum_of_squares)
+
+    def _backpropagate_summary(self, n_simulations: int, evaluation_sum: float, sum_of_squares: float):
+        if n_simulations == 1:
+            self.backpropagate(evaluation_sum)
+        elif n_simulations > 1:
+            self.backpropagate_batch(n_simulations, evaluation_sum, sum_of_squares)
+
+    def _iterate(self):
+        """ Run one select - expand - simulate - backpropagate cycle"""
+        self.search_tree.tick()
+        if self.instrumentation is None:
             self.select()
             self.expand()
-            simulation_evaluation = self.simulate()
-            if isinstance(simulation_evaluation, int):
-                # TODO: Not sure if int is sufficient
-                self.backpropagate(simulation_evaluation)
-            if i%10==0:
-                print("iteration nr: ", i+1, "/",n)
+            self._backpropagate_summary(*self._evaluate_leaf())
+        else:
+            self._iterate_instrumented()
+        self._enforce_node_budget()
+
+    def _iterate_instrumented(self):
+        """ _iterate() recording the time of every phase with self.instrumentation"""
+        instrumentation = self.instrumentation
+        node_count = self.search_tree.node_count
+        started = time.perf_counter()
+        self.select()
+        selected = time.perf_counter()
+        self.expand()
+        expanded = time.perf_counter()
+        if self.batch_rollouts:
+            # played and scored in one go, which is all counted as simulation, the rollout depths are not known
+            simulated_games = []
+            evaluations = self._rollout_batch(self.rollouts_per_leaf)
+            simulated = evaluated = time.perf_counter()
+        else:
+            simulated_games = [self._rollout() for _ in range(self.rollouts_per_leaf)]
+            simulated = time.perf_counter()
+            evaluations = self._evaluate_rollouts(simulated_games)
+            evaluated = time.perf_counter()
+        self._backpropagate_summary(*self._summarize(evaluations))
+        ended = time.perf_counter()
+        for phase, seconds in [("select", selected - started), ("expand", expanded - selected),
+                               ("simulate", simulated - expanded), ("evaluate", evaluated - simulated),
+                               ("backpropagate", ended - evaluated)]:
+            instrumentation.record_phase(phase, seconds)
+        depth = len(self.current_game.current_game_state)
+        instrumentation.record_rollouts([len(game.current_game_state) - depth for game in simulated_games])
+        tree_size = self.search_tree.node_count
+        instrumentation.record_iteration(started, ended, nodes_created=tree_size - node_count, tree_size=tree_size)
+
+    def _enforce_node_budget(self):
+        """ Evict cold subtrees once the search tree grows beyond its max_nodes"""
+        if not self.search_tree.over_budget:
+            return
+        self.search_tree.evict()
+        # evicted nodes must not be linked again, their ids may be reused
+        self.transposition_table.clear()
+        self.widening_cursors.clear()
+        self.current_nodes = []
+
+    def _lock_for(self, node) -> threading.Lock:
+        """ Lock guarding the statistics of node and the choice among its children
+
+        A node shared by several parents (transpositions) is always guarded by the same lock. Ids of SearchTree
+        nodes are memory addresses, which are aligned, so they are mixed before they are mapped onto the stripes.
+        """
+        mixed = (node.node_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return self._locks[(mixed >> 32) % len(self._locks)]
+
+    def _select_with_virtual_loss(self):
+        """ select() for tree-parallel search, every node on the path gets a virtual loss"""
+        self._rewind()
+        choose_child = self._choose_child_vectorized if self.vectorized_selection else self._choose_child
+        with self._lock_for(self.search_tree):
+            branch = self.search_tree[self.root_move]
+        with self._lock_for(branch):
+            branch.add_virtual_loss(self.virtual_loss)
+        self.current_nodes = [branch]
+        while self.current_game._check_game_over() is False:
+            with self._lock_for(branch):
+                if not len(branch) or self._can_widen(branch):
+                    break
+                # every worker only counts its own simulations in total_simulations_run, the passes of branch
+                # include those of all workers and are read under the lock that guards its statistics
+                chosen = choose_child(branch, parent_passes=branch.passes)
+                child = branch[chosen]
+            with self._lock_for(child):
+                child.add_virtual_loss(self.virtual_loss)
+            self.current_game.make_a_move(chosen)
+            self.current_path.append(chosen)
+            self.current_nodes.append(child)
+            branch = child
+        return self.current_path
+
+    def _expand_with_virtual_loss(self):
+        leaf = self.current_nodes[-1]
+        # without progressive widening the moves do not depend on the tree, they are generated before locking
+        children = None if self.progressive_widening else self.current_game.generate_next_moves()
+        if children is not None and not len(children):
+            return False
+        # adding nodes changes the tree structure, which needs all locks
+        with ExitStack() as stack:
+            for lock in self._locks:
+                stack.enter_context(lock)
+            if children is None:
+                children = self._moves_to_add(leaf)
+                if not len(children):
+                    return False
+            self._add_children(leaf, children)
+            expansion_child = self.rng.choice(children)
+            child = leaf[expansion_child]
+            child.add_virtual_loss(self.virtual_loss)
+        self.current_game.make_a_move(expansion_child)
+        self.current_path.append(expansion_child)
+        self.current_nodes.append(child)
+        return self.current_path
+
+    def _backpropagate_virtual_loss(self, n_simulations: int, evaluation_sum: float, sum_of_squares: float):
+        """ Revert the virtual loss along current_path and add the simulations"""
+        for node in self.current_nodes:
+            with self._lock_for(node):
+                node.revert_virtual_loss(self.virtual_loss)
+                node.merge(n_simulations, evaluation_sum, sum_of_squares)
+
+    def _iterate_with_virtual_loss(self):
+        self.search_tree.tick()
+        self._select_with_virtual_loss()
+        self._expand_with_virtual_loss()
+        self._backpropagate_virtual_loss(*self._evaluate_leaf())
+
+    def _make_tree_parallel_iteration(self, n: int, workers: int, virtual_loss: float, lock: str):
+        if lock not in self.lock_stripes:
+            raise ValueError("lock needs to be one of {options}".format(options=sorted(self.lock_stripes)))
+        if self.instrumentation is not None:
+            raise ValueError("instrumentation is not supported by the tree-parallel search (workers > 1).")
+        self._locks = [threading.Lock() for _ in range(self.lock_stripes[lock])]
+        self.virtual_loss = virtual_loss
+        worker_searches = []
+        for worker_rng in self.rng.spawn(workers):
+            worker_search = copy(self)
+            worker_search.current_game = self.game_master.clone()
+            worker_search.current_path = [self.root_move]
+            worker_search.rng = worker_rng
+            worker_searches.append(worker_search)
+
+        def run(worker_search, n_iterations):
+            for _ in range(n_iterations):
+                worker_search._iterate_with_virtual_loss()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, worker_search, n // workers + (i < n % workers))
+                       for i, worker_search in enumerate(worker_searches)]
+            for future in futures:
+                future.result()
+        self.total_simulations_run += sum(worker_search.total_simulations_run - self.total_simulations_run
+                                          for worker_search in worker_searches)
+        # workers share the tree, so the node budget is only enforced once all of them are done
+        self._enforce_node_budget()
+
+    def make_iteration(self, n=1, workers: int = 1, virtual_loss: float = 1., lock: str = "tree"):
+        """
+        :param n: number of iterations
+        :param workers: number of threads sharing the search tree, workers > 1 runs a tree-parallel search
+        :param virtual_loss: value subtracted from every node on a path while a worker is simulating it,
+        this makes concurrent workers diverge onto different paths
+        :param lock: "tree" guards the tree with a single lock, "node" uses striped locks per node. Adding nodes
+        always takes all locks. The rollout_policy object is shared by all workers.
+        """
+        if workers > 1:
+            self._make_tree_parallel_iteration(n, workers=workers, virtual_loss=virtual_loss, lock=lock)
+            return
+        for _ in range(n):
+            self._iterate()
 
     def get_best_path(self):
-        best_path = [self.game_master.root]
+        best_path = list(self.committed_path)
 
-        current = self.search_tree[self.game_master.root]
-        child_value_pairs = sorted(filter(lambda tup: isinstance(tup[1], float) or isinstance(tup[1], int),
-                                          map(lambda x: [x, current[x].average_path_value], current.keys())),
-                                   key=lambda tup: tup[1], reverse=True)
-        while len(child_value_pairs):
-            best_child_name = child_value_pairs[0][0]
-            best_path.append(best_child_name)
-            current = current[best_child_name]
+        current = self.search_tree.get(self.root_move)
+        while current is not None:
+            # items() does not create nodes, unlike item access
             child_value_pairs = sorted(filter(lambda tup: isinstance(tup[1], float) or isinstance(tup[1], int),
-                                              map(lambda x: [x, current[x].average_path_value], current.keys())),
+                                              map(lambda x: [x[0], x[1].average_path_value], current.items())),
                                        key=lambda tup: tup[1], reverse=True)
+            if not len(child_value_pairs):
+                break
+            best_child_name = child_value_pairs[0][0]
+            best_path.append(best_child_name)
+            current = current.get(best_child_name)
         return best_path
 
-    def start(self, rounds=6):
-        for i in range(round):
-            self.make_iteration()
+    def commit_move(self, move: str):
+        """ Play move in game_master and keep searching from there
+
+        The subtree below move becomes the new root of the search tree, so its statistics are reused
+        for the next decision. All sibling subtrees are dropped.
+        """
+        self.game_master.make_a_move(move)
+        self.search_tree.reroot(self.root_move, move)
+        # dropped nodes must not be linked again, their ids may be reused
+        self.transposition_table.clear()
+        self.widening_cursors.clear()
+        self.root_move = move
+        self.committed_path.append(move)
+        self.current_game = self.game_master.clone()
+        self.current_path = [self.root_move]
+
+    def search(self, time_limit: float = None, max_iterations: int = None, max_nodes: int = None,
+               check_interval: int = 16) -> SearchResult:
+        """ Run iterations until the first of the given limits is reached
+
+        :param time_limit: wall-clock budget in seconds
+        :param max_iterations: maximum number of iterations
+        :param max_nodes: stop once the search tree holds this many nodes
+        :param check_interval: the clock and the tree size are only checked every check_interval iterations
+        :return: best path, iterations completed, elapsed seconds and the limit that stopped the search
+        """
+        if time_limit is None and max_iterations is None and max_nodes is None:
+            raise ValueError("At least one of time_limit, max_iterations and max_nodes is needed.")
+        start = time.perf_counter()
+        deadline = None if time_limit is None else start + time_limit
+        iterations = 0
+        stop_reason = None
+        while stop_reason is None:
+            if max_iterations is not None and iterations >= max_iterations:
+                stop_reason = "max_iterations"
+            elif iterations % check_interval == 0 and deadline is not None and time.perf_counter() >= deadline:
+                stop_reason = "time_limit"
+            elif iterations % check_interval == 0 and max_nodes is not None and self.search_tree.node_count >= max_nodes:
+                stop_reason = "max_nodes"
+            else:
+                self._iterate()
+                iterations += 1
+        return SearchResult(best_path=self.get_best_path(), iterations=iterations,
+                            elapsed=time.perf_counter() - start, stop_reason=stop_reason)
+
+    def _run_slice(self, n_iterations: int, deadline: float, max_nodes: int,
+                   cancelled: threading.Event) -> Tuple[int, str]:
+        """ Run up to n_iterations, stopping early at the deadline, at max_nodes or once cancelled is set
+
+        :return: iterations run and the reason the slice stopped early, None if it ran all iterations
+        """
+        for i in range(n_iterations):
+            if cancelled.is_set():
+                return i, "cancelled"
+            if deadline is not None and time.perf_counter() >= deadline:
+                return i, "time_limit"
+            if max_nodes is not None and self.search_tree.node_count >= max_nodes:
+                return i, "max_nodes"
+            self._iterate()
+        return n_iterations, None
+
+    async def stream_best_paths(self, time_limit: float = None, max_iterations: int = None, max_nodes: int = None,
+                                slice_size: int = 32, executor=None) -> AsyncIterator[SearchResult]:
+        """ Search in slices and yield a result every time the best path changed
+
+        The event loop gets control back after every slice of slice_size iterations. Without an executor a slice
+        runs on the loop and blocks it until the slice is over, choose slice_size so that a slice is short.
+        With an executor (e.g. a ThreadPoolExecutor) the slices run there and the loop is not blocked.
+        Either way the limits are only checked between iterations, so a search may overrun time_limit by one
+        iteration. Cancelling the task consuming the results stops the search after the running iteration,
+        the cancellation completes once that iteration is over.
+        Only one search may run on the same MonteCarloTreeSearch at a time.
+
+        :param time_limit: wall-clock budget in seconds
+        :param max_iterations: maximum number of iterations
+        :param max_nodes: stop once the search tree holds this many nodes
+        :return: SearchResults with stop_reason None while searching, the last one carries the limit that
+        stopped the search
+        """
+        if time_limit is None and max_iterations is None and max_nodes is None:
+            raise ValueError("At least one of time_limit, max_iterations and max_nodes is needed.")
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        deadline = None if time_limit is None else start + time_limit
+        iterations = 0
+        best_path = None
+        stop_reason = None
+        while stop_reason is None:
+            if max_iterations is not None and iterations >= max_iterations:
+                stop_reason = "max_iterations"
+                break
+            n_iterations = slice_size if max_iterations is None else min(slice_size, max_iterations - iterations)
+            cancelled = threading.Event()
+            if executor is None:
+                completed, stop_reason = self._run_slice(n_iterations, deadline, max_nodes, cancelled)
+                await asyncio.sleep(0)
+            else:
+                slice_future = executor.submit(self._run_slice, n_iterations, deadline, max_nodes, cancelled)
+                try:
+                    completed, stop_reason = await asyncio.wrap_future(slice_future, loop=loop)
+                except asyncio.CancelledError:
+                    # the slice running in the executor stops after its current iteration, wait for it so that
+                    # the search no longer touches the tree once the cancellation is done
+                    cancelled.set()
+                    await asyncio.wrap_future(slice_future, loop=loop)
+                    raise
+            iterations += completed
+            path = self.get_best_path()
+            if stop_reason is None and path != best_path:
+                best_path = path
+                yield SearchResult(best_path=path, iterations=iterations, elapsed=time.perf_counter() - start,
+                                   stop_reason=None)
+        yield SearchResult(best_path=self.get_best_path(), iterations=iterations,
+                           elapsed=time.perf_counter() - start, stop_reason=stop_reason)
+
+    async def search_async(self, time_limit: float = None, max_iterations: int = None, max_nodes: int = None,
+                           slice_size: int = 32, executor=None) -> SearchResult:
+        """ search() for asyncio code, runs in slices as described in stream_best_paths()"""
+        result = None
+        async for result in self.stream_best_paths(time_limit=time_limit, max_iterations=max_iterations,
+                                                   max_nodes=max_nodes, slice_size=slice_size, executor=executor):
+            pass
+        return result
+
+    def start(self, rounds=6) -> SearchResult:
+        return self.search(max_iterations=rounds)
 
 
 if __name__ == "__main__":
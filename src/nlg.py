@@ -1,17 +1,29 @@
-from typing import List
+from copy import copy
+from itertools import chain
+from typing import Iterator, List
 
-from game import Game, GameInitiationError, MoveNotAllowedError
+from game import Game, GameInitiationError, GameStateError, MoveNotAllowedError
 from sentence_classifier.sentence_classifier import SentenceClassifier
 
 
 class NLGame(Game):
-    def __init__(self, vocabulary: List[str], current_game_state: List[str], starting_word: str):
+    def __init__(self, vocabulary: List[str], current_game_state: List[str], starting_word: str,
+                 sentence_classifier: SentenceClassifier = None):
+        """
+        :param sentence_classifier: Already loaded classifier to share between games, a new one is loaded if None
+        """
         super(NLGame, self).__init__()
         self.root = starting_word
         self.possible_moves = vocabulary
+        self._vocabulary = set(vocabulary)
+        # first word -> known successors in vocabulary order, built on first use and shared by all clones
+        self._successors = {}
         self.current_game_state = current_game_state
+        self._n_moves_made = 0
         self._check_game_correctly_initiated()
-        self.sentence_classifier = SentenceClassifier(acceptance_threshold=1.5, trigram_importance=5)
+        if sentence_classifier is None:
+            sentence_classifier = SentenceClassifier(acceptance_threshold=1.5, trigram_importance=5)
+        self.sentence_classifier = sentence_classifier
         self.sentence_length = 5
 
     def _check_game_correctly_initiated(self):
@@ -27,9 +39,7 @@ class NLGame(Game):
 
     def _check_move_possible(self, move):
         """ Test if move is allowed"""
-        if move not in self.possible_moves:
-            return False
-        return True
+        return move in self._vocabulary
 
     def _check_game_over(self):
         """ Test if another move is possible or if the game has terminated"""
@@ -42,11 +52,54 @@ class NLGame(Game):
         if not self._check_move_possible(move):
             raise MoveNotAllowedError("Cannot make this move: '{}'.".format(move))
         self.current_game_state.append(move)
+        self._n_moves_made += 1
         return
 
+    def undo_move(self):
+        """ Remove the last word added with make_a_move"""
+        if self._n_moves_made == 0:
+            raise GameStateError("No move left to undo.")
+        self.current_game_state.pop()
+        self._n_moves_made -= 1
+
+    def clone(self) -> "NLGame":
+        """ Copy of the game sharing vocabulary and sentence classifier"""
+        clone = copy(self)
+        clone.current_game_state = list(self.current_game_state)
+        return clone
+
     def generate_next_moves(self):
         return list(filter(lambda move: self._check_move_possible(move), self.possible_moves))
 
+    def terminal_key(self) -> tuple:
+        """ The sentence"""
+        return tuple(self.current_game_state)
+
+    def order_moves(self, moves: List[str]) -> List[str]:
+        """ Words forming a known bigram with the last word of the sentence first"""
+        last_word = self.current_game_state[-1]
+        known_bigrams = self.sentence_classifier.known_bigrams
+        return sorted(moves, key=lambda move: (last_word, move) not in known_bigrams)
+
+    def _known_successors(self, word: str) -> List[str]:
+        if not self._successors:
+            positions = {move: position for position, move in enumerate(self.possible_moves)}
+            successors = {}
+            for first, second in self.sentence_classifier.known_bigrams:
+                if second in positions:
+                    successors.setdefault(first, []).append(second)
+            for words in successors.values():
+                words.sort(key=positions.get)
+            # threads racing here build the same index
+            self._successors.update(successors)
+        return self._successors.get(word, [])
+
+    def widening_order(self) -> Iterator[str]:
+        """ Lazy order_moves(generate_next_moves()): known successors of the last word, then the other words"""
+        successors = self._known_successors(self.current_game_state[-1])
+        known = set(successors)
+        return chain(successors, (move for move in self.possible_moves if move not in known))
+
     def evaluate_game(self) -> int:
         """ Evaluate if this sentence is human or not
 
@@ -54,6 +107,14 @@ class NLGame(Game):
         """
         return int(self.sentence_classifier.sentence_is_human(self.current_game_state))
 
+    def evaluate_games(self, states: List["NLGame"]) -> List[int]:
+        """ Evaluate several sentences with a single classifier call
+
+        :return: 1 for every human sentence, 0 for every fake one
+        """
+        word_sequences = [state.current_game_state for state in states]
+        return [int(is_human) for is_human in self.sentence_classifier.sentences_are_human(word_sequences)]
+
 if __name__ == "__main__":
     N = NLGame(vocabulary=["my", "name", "is", "was", "john", "michael", "smith", "miller"],
                current_game_state=["my"],
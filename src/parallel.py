@@ -0,0 +1,154 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from monte_carlo import MonteCarloTreeSearch
+from tree import SearchTree
+
+
+def collect_statistics(node, depth: int, path: Tuple = ()) -> Dict[Tuple, Tuple[int, float, float]]:
+    """ Passes, value sums and sums of squares of all visited nodes up to depth moves below node
+
+    :param node: tree node, its children are keyed by move
+    :param depth: number of levels to collect below node
+    :param path: moves leading to node
+    :return: dict mapping the move path of a node to (passes, value_sum, sum_of_squares)
+    """
+    statistics = {}
+    for move, child in node.items():
+        if child.passes == 0:
+            continue
+        child_path = path + (move,)
+        statistics[child_path] = (child.passes, child.value_sum, child.sum_of_squares)
+        if depth > 0:
+            statistics.update(collect_statistics(child, depth - 1, child_path))
+    return statistics
+
+
+def merge_statistics(tree, statistics: Dict[Tuple, Tuple[int, float, float]]):
+    """ Add statistics as returned by collect_statistics into tree"""
+    for path, (passes, value_sum, sum_of_squares) in statistics.items():
+        node = tree
+        for move in path:
+            node = node[move]
+        node.merge(passes, value_sum, sum_of_squares)
+
+
+# search of a worker process and the statistics it reported so far, set up by _start_worker
+_worker_search = None
+_worker_reported = {}
+
+
+def _start_worker(game_object, tree_factory, seed: int, search_kwargs: Dict):
+    global _worker_search, _worker_reported
+    _worker_search = MonteCarloTreeSearch(game_object=game_object, tree_object=tree_factory(), seed=seed,
+                                          **search_kwargs)
+    _worker_reported = {}
+
+
+def _continue_search(n_iterations: int, merge_depth: int):
+    """ Run n_iterations more in the tree of this worker
+
+    :return: statistics added since the last call (as collect_statistics), simulations run and the search time
+    """
+    global _worker_reported
+    simulations_run = _worker_search.total_simulations_run
+    start = time.perf_counter()
+    for _ in range(n_iterations):
+        _worker_search._iterate()
+    elapsed = time.perf_counter() - start
+    # the tree is keyed by the root move, the root itself is depth 0
+    statistics = collect_statistics(_worker_search.search_tree, merge_depth)
+    added = {}
+    for path, (passes, value_sum, sum_of_squares) in statistics.items():
+        old_passes, old_value_sum, old_sum_of_squares = _worker_reported.get(path, (0, 0., 0.))
+        if passes != old_passes:
+            added[path] = (passes - old_passes, value_sum - old_value_sum, sum_of_squares - old_sum_of_squares)
+    _worker_reported = statistics
+    return added, _worker_search.total_simulations_run - simulations_run, elapsed
+
+
+class RootParallelSearch(object):
+    """ Run independent searches from the same game in a process pool and merge their statistics
+
+    Every worker builds its own tree with its own seed and keeps it across calls of make_iteration.
+    After every call the visits and value sums the workers added to the root and the nodes up to
+    merge_depth moves below it are added into one tree, so that get_best_path works on the combined result.
+    The worker processes run until shutdown() is called or the search is left as a context manager.
+    """
+
+    def __init__(self, game_object, tree_factory=SearchTree, n_workers: int = None, merge_depth: int = 1,
+                 seed: int = None, **search_kwargs):
+        """
+        :param tree_factory: class (or other picklable callable) building an empty tree for each worker
+        :param n_workers: number of processes, defaults to the number of cores
+        :param merge_depth: number of levels below the root whose statistics are merged
+        :param seed: base seed, worker i is seeded with seed + i
+        :param search_kwargs: passed on to every MonteCarloTreeSearch
+        """
+        self.game_master = game_object
+        self.tree_factory = tree_factory
+        self.n_workers = n_workers or os.cpu_count()
+        self.merge_depth = merge_depth
+        self.seed = random.randrange(2 ** 31) if seed is None else seed
+        self.search_kwargs = search_kwargs
+        self.search = MonteCarloTreeSearch(game_object=game_object, tree_object=tree_factory(), **search_kwargs)
+        self.report = {}
+        # one single-process pool per worker, so that every call reaches the same tree
+        self._executors = []
+
+    @property
+    def search_tree(self):
+        return self.search.search_tree
+
+    def _start_workers(self):
+        self._executors = [ProcessPoolExecutor(max_workers=1, initializer=_start_worker,
+                                               initargs=(self.game_master, self.tree_factory, self.seed + i,
+                                                         self.search_kwargs))
+                           for i in range(self.n_workers)]
+
+    def make_iteration(self, n: int = 1) -> Dict:
+        """ Run n more iterations in every worker and merge the results into search_tree
+
+        The worker processes are started by the first call.
+
+        :param n: iterations per worker
+        :return: report with total iterations and iterations per second overall and per worker, measured over
+        the search only (without starting processes and transferring the statistics)
+        """
+        if not self._executors:
+            self._start_workers()
+        futures = [executor.submit(_continue_search, n, self.merge_depth) for executor in self._executors]
+        results = [future.result() for future in futures]
+
+        worker_elapsed = []
+        for statistics, simulations_run, elapsed in results:
+            merge_statistics(self.search.search_tree, statistics)
+            self.search.total_simulations_run += simulations_run
+            worker_elapsed.append(elapsed)
+        # the workers search at the same time, the slowest one decides
+        elapsed = max(worker_elapsed)
+        self.report = {"workers": self.n_workers,
+                       "iterations": n * self.n_workers,
+                       "elapsed": elapsed,
+                       "iterations_per_second": n * self.n_workers / elapsed if elapsed > 0 else float("inf"),
+                       "worker_iterations_per_second": [n / worker if worker > 0 else float("inf")
+                                                        for worker in worker_elapsed]}
+        return self.report
+
+    def get_best_path(self) -> List[str]:
+        return self.search.get_best_path()
+
+    def shutdown(self):
+        """ Stop the worker processes, their trees are lost"""
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+
+    def __enter__(self) -> "RootParallelSearch":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,65 @@
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, Sequence, Union
+
+import numpy as np
+
+
+class RandomStream(object):
+    """ Seedable source of random numbers for one search
+
+    Uniform variates are drawn from a NumPy Generator in blocks of block_size and served one by one,
+    which is much cheaper per draw than calling into NumPy (or numpy.random.choice) for every decision.
+    Streams created with spawn() are statistically independent of each other and of their parent.
+    """
+    block_size = 4096
+
+    def __init__(self, seed: Union[int, np.random.SeedSequence] = None, block_size: int = None):
+        """
+        :param seed: integer seed or SeedSequence, None seeds from the operating system
+        :param block_size: number of uniform variates drawn at once
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.generator = np.random.default_rng(seed)
+        if block_size is not None:
+            self.block_size = block_size
+        self._buffer = self.generator.random(self.block_size)
+        self._position = 0
+
+    def spawn(self, n_streams: int) -> List["RandomStream"]:
+        """ Independent streams, e.g. one per worker"""
+        return [RandomStream(seed, self.block_size) for seed in self.seed_sequence.spawn(n_streams)]
+
+    def random(self) -> float:
+        """ Uniform variate in [0, 1)"""
+        if self._position == self.block_size:
+            self._buffer = self.generator.random(self.block_size)
+            self._position = 0
+        value = self._buffer[self._position]
+        self._position += 1
+        return float(value)
+
+    def integer(self, n: int) -> int:
+        """ Uniform integer in [0, n)"""
+        return min(int(self.random() * n), n - 1)
+
+    def choice(self, sequence: Sequence):
+        """ Uniformly chosen element of sequence"""
+        return sequence[self.integer(len(sequence))]
+
+    def weighted_index(self, weights: Union[Sequence[float], np.ndarray]) -> int:
+        """ Position i chosen with probability weights[i] / sum(weights), weights need not be normalized"""
+        if isinstance(weights, np.ndarray):
+            cumulative_weights = np.cumsum(weights)
+            position = int(np.searchsorted(cumulative_weights, self.random() * cumulative_weights[-1], side="right"))
+        else:
+            # converting a short list to an array costs more than summing it up in Python
+            cumulative_weights = list(accumulate(weights))
+            position = bisect_right(cumulative_weights, self.random() * cumulative_weights[-1])
+        return min(position, len(cumulative_weights) - 1)
+
+    def weighted_choice(self, sequence: Sequence, weights: Union[Sequence[float], np.ndarray]):
+        """ Element of sequence chosen proportionally to weights"""
+        return sequence[self.weighted_index(weights)]
@@ -0,0 +1,74 @@
+from typing import Dict, List, Set, Tuple
+
+from game import Game
+from random_stream import RandomStream
+
+
+class RolloutPolicy(object):
+    """ Chooses the moves played during the simulation phase of MonteCarloTreeSearch
+
+    To be used as a parent class, the policy is asked once per move of every rollout.
+    A tree-parallel search calls choose_move of the same policy object from several threads at once,
+    so it must not change the state of the policy (other than idempotent caching).
+    """
+
+    def choose_move(self, game: Game, moves: List, rng: RandomStream):
+        """
+        :param game: game in the state the move is played from
+        :param moves: legal moves as returned by game.generate_next_moves(), never empty
+        :param rng: random stream of the search
+        :return: one of moves
+        """
+        raise NotImplementedError
+
+
+class UniformRollout(RolloutPolicy):
+    """ Every legal move is equally likely"""
+
+    def choose_move(self, game: Game, moves: List, rng: RandomStream):
+        return rng.choice(moves)
+
+
+class NearestNeighbourRollout(RolloutPolicy):
+    """ Epsilon-greedy tour construction for TravelingTourist: mostly travel to the closest unvisited city"""
+
+    def __init__(self, epsilon: float = 0.1):
+        """
+        :param epsilon: probability of a uniformly random move instead of the nearest city
+        """
+        self.epsilon = epsilon
+
+    def choose_move(self, game: Game, moves: List[str], rng: RandomStream) -> str:
+        if len(moves) == 1 or rng.random() < self.epsilon:
+            return rng.choice(moves)
+        current_city = game.current_game_state[-1]
+        return min(moves, key=lambda move: game.city_grid.distance_between_two_cities(current_city, move))
+
+
+class BigramRollout(RolloutPolicy):
+    """ Sampling for NLGame that prefers words known to follow the last word of the sentence"""
+
+    def __init__(self, successor_weight: float = 10., known_bigrams: Set[Tuple[str, str]] = None):
+        """
+        :param successor_weight: weight of a word forming a known bigram with the last word, other words weigh 1
+        :param known_bigrams: defaults to the known bigrams of the sentence classifier of the game
+        """
+        self.successor_weight = successor_weight
+        self._successors = None if known_bigrams is None else self._index_successors(known_bigrams)
+
+    @staticmethod
+    def _index_successors(known_bigrams: Set[Tuple[str, str]]) -> Dict[str, Set[str]]:
+        successors = {}
+        for first, second in known_bigrams:
+            successors.setdefault(first, set()).add(second)
+        return successors
+
+    def choose_move(self, game: Game, moves: List[str], rng: RandomStream) -> str:
+        if self._successors is None:
+            # threads racing here build the same index, whichever assignment wins is fine
+            self._successors = self._index_successors(game.sentence_classifier.known_bigrams)
+        successors = self._successors.get(game.current_game_state[-1])
+        if not successors:
+            return rng.choice(moves)
+        weights = [self.successor_weight if move in successors else 1. for move in moves]
+        return rng.weighted_choice(moves, weights)
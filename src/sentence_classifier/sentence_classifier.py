@@ -68,6 +68,18 @@ class SentenceClassifier(object):
         # return score >= self.acceptance_threshold
         return bool(self.sentence_classifier.predict([[overlap_scores["bigram"], overlap_scores["trigram"]]])[0])
 
+    def sentences_are_human(self, word_sequences: List[List[str]]) -> List[bool]:
+        """ Batched sentence_is_human, all sentences are classified with one predict call
+
+        :param word_sequences:
+        :return: True for every human sentence, False for every fake one
+        """
+        if not len(word_sequences):
+            return []
+        overlap_scores = [self.compute_feature(word_sequence) for word_sequence in word_sequences]
+        features = [[scores["bigram"], scores["trigram"]] for scores in overlap_scores]
+        return [bool(prediction) for prediction in self.sentence_classifier.predict(features)]
+
     def compute_feature(self, word_sequence: List[str]) -> bool:
         """ Determine if sentence is human or fake
 
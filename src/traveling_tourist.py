@@ -1,12 +1,122 @@
-from typing import List, Dict
+import os
+import threading
+from copy import copy
+from typing import Iterator, List, Dict, Tuple
 
 import geopy
+import numpy as np
 import pandas as pd
 from geopy import distance
 
 from game import Game, MoveNotAllowedError, GameStateError, GameInitiationError
 
 
+class CityIndex(object):
+    """ Coordinates of all known cities, looked up by lower case city name
+
+    The packaged csv is parsed once per process, see shared(). With a sidecar, the parsed columns are also
+    written next to the csv as .npy files and memory mapped on later starts instead of parsing the csv again.
+    """
+    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "large_cities.csv")
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, names: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray):
+        """
+        :param names: lower case city names, names occurring more than once are ambiguous and left out
+        :param latitudes: in degrees, same order as names
+        :param longitudes: in degrees, same order as names
+        """
+        self.names = names
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        positions = {}
+        for position, name in enumerate(names.tolist()):
+            positions[name] = -1 if name in positions else position
+        self.positions = {name: position for name, position in positions.items() if position >= 0}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, name: str):
+        return name.lower() in self.positions
+
+    @classmethod
+    def shared(cls) -> "CityIndex":
+        """ Index of the packaged csv, loaded on first use and reused by every game of the process"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls.load(sidecar=True)
+        return cls._shared
+
+    @staticmethod
+    def _sidecar_paths(csv_path: str) -> Tuple[str, str]:
+        stem = os.path.splitext(csv_path)[0]
+        return stem + ".names.npy", stem + ".coordinates.npy"
+
+    @classmethod
+    def load(cls, csv_path: str = None, sidecar: bool = False) -> "CityIndex":
+        """
+        :param csv_path: csv with the columns City, Latitude and Longitude, the packaged one if None
+        :param sidecar: memory map the sidecar if it is at least as new as the csv and can be read, otherwise parse
+        the csv and try to write the sidecar
+        """
+        csv_path = csv_path or cls.csv_path
+        names_path, coordinates_path = cls._sidecar_paths(csv_path)
+        if sidecar and all(os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path)
+                           for path in [names_path, coordinates_path]):
+            try:
+                names = np.load(names_path)
+                coordinates = np.load(coordinates_path, mmap_mode="r")
+                if coordinates.shape == (len(names), 2):
+                    return cls(names, coordinates[:, 0], coordinates[:, 1])
+            except (OSError, ValueError, EOFError):
+                # truncated or unreadable sidecar, it is written again below
+                pass
+        cities = pd.read_csv(csv_path, usecols=["City", "Latitude", "Longitude"])
+        # .values instead of to_numpy(), which needs pandas 0.24, is an extension array on recent pandas
+        names = np.asarray(cities["City"].astype(str).str.lower().values, dtype=str)
+        coordinates = np.asarray(cities[["Latitude", "Longitude"]].values, dtype=np.float64)
+        if sidecar:
+            try:
+                cls._save_atomically(names_path, names)
+                cls._save_atomically(coordinates_path, coordinates)
+            except OSError:
+                # a read-only installation only misses out on the faster start
+                pass
+        return cls(names, coordinates[:, 0], coordinates[:, 1])
+
+    @staticmethod
+    def _save_atomically(path: str, array: np.ndarray):
+        """ Save array to path through a temporary file, so that readers never see a partially written file"""
+        # processes starting at the same time may all write the sidecar, each with a temporary file of its own
+        temporary_path = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+        try:
+            with open(temporary_path, "wb") as f:
+                np.save(f, array)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def coordinates(self, name: str) -> Tuple[float, float]:
+        """ Latitude and longitude of one city, raises KeyError for unknown cities"""
+        position = self.positions.get(name.lower())
+        if position is None:
+            raise KeyError("City {name} not found.".format(name=name.lower()))
+        return float(self.latitudes[position]), float(self.longitudes[position])
+
+    def batch_coordinates(self, names: List[str]) -> np.ndarray:
+        """ Latitudes and longitudes in degrees, one row per name, NaN for cities that are not known"""
+        positions = np.array([self.positions.get(name.lower(), -1) for name in names], dtype=np.int64)
+        coordinates = np.full((len(names), 2), np.nan)
+        known = positions >= 0
+        coordinates[known, 0] = self.latitudes[positions[known]]
+        coordinates[known, 1] = self.longitudes[positions[known]]
+        return coordinates
+
+
 class City(object):
     def __init__(self, city_name: str):
         self.name = city_name.lower()
@@ -14,13 +124,7 @@ class City(object):
         self.latitude = None
 
     def compute_coordinates(self):
-        distances = pd.read_csv("/home/jjb/Dropbox/Programming/GIT/mcts/src/resources/large_cities.csv")
-        search = distances[distances["City"] == self.name]
-        if len(search) == 1 and len(list(search["Latitude"])) == 1 and len(list(search["Longitude"])) == 1:
-            self.latitude = float(list(search["Latitude"])[0])
-            self.longitude = float(list(search["Longitude"])[0])
-        else:
-            raise KeyError("City {name} not found.".format(name=self.name))
+        self.latitude, self.longitude = CityIndex.shared().coordinates(self.name)
 
     @property
     def coordinates(self) -> Dict[str, float]:
@@ -30,43 +134,216 @@ class City(object):
 
 
 class CityGrid(object):
-    def __init__(self, city_names: List[str]):
+    """ Cities of one game and the distances between all of them
+
+    The distances are computed once for all pairs, the first time they are needed.
+    """
+    distance_methods = ("haversine", "geodesic")
+    earth_radius_km = 6371.0088
+
+    def __init__(self, city_names: List[str], distance_method: str = "haversine"):
+        """
+        :param distance_method: "haversine" computes great-circle distances on a sphere with NumPy, "geodesic"
+        computes exact distances on the WGS-84 ellipsoid with geopy, one pair at a time
+        """
+        if distance_method not in self.distance_methods:
+            raise ValueError("distance_method needs to be one of {options}".format(options=self.distance_methods))
         self.city_names = city_names
         self.cities = {name: City(name) for name in self.city_names}
+        self.city_index = {name: index for index, name in enumerate(self.cities)}
+        self.distance_method = distance_method
+        self._distance_matrix = None
+        self._nearest_neighbours = {}
+        self._cities_by_distance = {}
+
+    @property
+    def distance_matrix(self) -> np.ndarray:
+        """ Distances in km, rows and columns are ordered by city_index"""
+        if self._distance_matrix is None:
+            if self.distance_method == "haversine":
+                self._distance_matrix = self._haversine_distances()
+            else:
+                self._distance_matrix = self._geodesic_distances()
+        return self._distance_matrix
+
+    def _coordinates(self) -> np.ndarray:
+        """ Latitudes and longitudes in degrees, one row per city, NaN for cities that are not known"""
+        # unknown cities only fail once a distance to them is asked for
+        coordinates = CityIndex.shared().batch_coordinates(list(self.cities))
+        for city, (latitude, longitude) in zip(self.cities.values(), coordinates):
+            if not np.isnan(latitude):
+                city.latitude, city.longitude = float(latitude), float(longitude)
+        return coordinates
+
+    def _haversine_distances(self) -> np.ndarray:
+        latitudes, longitudes = np.radians(self._coordinates()).T
+        half_latitude_differences = (latitudes[:, None] - latitudes[None, :]) / 2
+        half_longitude_differences = (longitudes[:, None] - longitudes[None, :]) / 2
+        a = (np.sin(half_latitude_differences) ** 2
+             + np.cos(latitudes[:, None]) * np.cos(latitudes[None, :]) * np.sin(half_longitude_differences) ** 2)
+        return 2 * self.earth_radius_km * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+    def _geodesic_distances(self) -> np.ndarray:
+        coordinates = self._coordinates()
+        n = len(coordinates)
+        distances = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                if np.isnan(coordinates[[i, j]]).any():
+                    distances[i, j] = distances[j, i] = np.nan
+                else:
+                    distances[i, j] = distances[j, i] = distance.geodesic(coordinates[i], coordinates[j]).km
+        return distances
+
+    def _raise_for_unknown_cities(self, indices: np.ndarray):
+        for index in np.unique(indices):
+            if np.isnan(self.distance_matrix[index]).all():
+                raise KeyError("City {name} not found.".format(name=list(self.cities)[index].lower()))
 
     def distance_between_two_cities(self, city1_name: str, city2_name: str) -> float:
         """
         :param city1: Name of one city
         :param city2: Name of another city
-        :return: The distance in meters
+        :return: The distance in km
+        """
+        indices = self.city_index[city1_name], self.city_index[city2_name]
+        city_distance = float(self.distance_matrix[indices])
+        if np.isnan(city_distance):
+            self._raise_for_unknown_cities(np.array(indices))
+        return city_distance
+
+    def nearest_neighbours(self, k: int) -> np.ndarray:
+        """ Indices of the k closest other cities of every city, closest first, one row per city
+
+        Cities without known coordinates are never among the neighbours. The lists are taken from the dense
+        distance_matrix, which needs O(n^2) memory for n cities.
+        """
+        k = min(k, len(self.cities) - 1)
+        if k not in self._nearest_neighbours:
+            distances = np.where(np.isnan(self.distance_matrix), np.inf, self.distance_matrix)
+            np.fill_diagonal(distances, np.inf)
+            if k <= 0:
+                nearest = np.empty((len(distances), 0), dtype=np.int64)
+            else:
+                nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1, kind="stable")
+                nearest = np.take_along_axis(nearest, order, axis=1)
+            self._nearest_neighbours[k] = nearest
+        return self._nearest_neighbours[k]
+
+    def cities_by_distance(self, index: int) -> List[int]:
+        """ Indices of all cities ordered by their distance from the city with the given index, closest first
+
+        Computed once per city. Cities without known coordinates come last.
         """
-        for name in [city1_name, city2_name]:
-            assert name in self.cities, "City name was not found in list given with initiation."
-        city1 = self.cities[city1_name]
-        city2 = self.cities[city2_name]
-        return distance.distance(city1.coordinates, city2.coordinates).km
+        if index not in self._cities_by_distance:
+            self._cities_by_distance[index] = np.argsort(self.distance_matrix[index], kind="stable").tolist()
+        return self._cities_by_distance[index]
+
+    def tour_length(self, tour: List[int]) -> float:
+        """ Length in km of the path through the cities with the given indices"""
+        tour = np.asarray(tour)
+        length = float(self.distance_matrix[tour[:-1], tour[1:]].sum())
+        if np.isnan(length):
+            self._raise_for_unknown_cities(tour)
+        return length
 
 
 class TravelingTourist(Game):
-    def __init__(self, possible_moves: List[str], current_game_state: List[str], home_town: str):
+    """ Round trip through all cities in possible_moves, scored by its length
+
+    Internally cities are integer indices into city_grid. The cities still to visit and the visited
+    cities are kept as bitmasks, so checking and generating moves needs no string comparisons.
+    possible_moves and current_game_state keep their list-of-names interface.
+    The length of the tour so far is kept up to date by every move, see tour_length.
+    For large instances, candidate_neighbours restricts the generated moves to the closest cities.
+    """
+
+    def __init__(self, possible_moves: List[str], current_game_state: List[str], home_town: str,
+                 distance_method: str = "haversine", candidate_neighbours: int = None):
+        """
+        :param distance_method: how CityGrid computes distances, "haversine" or the exact but slower "geodesic"
+        :param candidate_neighbours: k, if given generate_next_moves only offers the k cities closest to the current
+        city, or every legal city once all of those were visited. This narrows the tree, not the memory: the
+        distances are still held as an n x n matrix. rollout_batch() ignores the candidates, so
+        MonteCarloTreeSearch(batch_rollouts=True) rejects such a game.
+        """
         super(TravelingTourist, self).__init__()
         self.root = home_town
-        self.possible_moves = possible_moves
-        self.current_game_state = current_game_state
-        self.city_grid = CityGrid(self.possible_moves + self.current_game_state)
         self._check_game_correctly_initiated()
+        # cities of possible_moves get the lowest indices, in their order, so that the bitmask keeps the order
+        self.city_grid = CityGrid(possible_moves + current_game_state, distance_method)
+        self._city_names = list(self.city_grid.cities)
+        self._root_bit = 1 << self.city_grid.city_index[self.root] if self.root in self.city_grid.city_index else 0
+        self.possible_moves = possible_moves
+        self.current_game_state = list(current_game_state)
+        self._tour = [self.city_grid.city_index[city] for city in current_game_state]
+        self._visits = [0] * len(self._city_names)
+        self._visited = 0
+        for index in self._tour:
+            self._visits[index] += 1
+            self._visited |= 1 << index
+        self._n_moves_made = 0
+        self._distances = self.city_grid.distance_matrix
+        # no round trip through the cities is longer than going to the farthest other city from each of them
+        known_distances = np.where(np.isnan(self._distances), 0., self._distances)
+        self._longest_tour = float(known_distances.max(axis=1, initial=0.).sum())
+        self.candidate_neighbours = candidate_neighbours
+        self._candidate_masks = None
+        if candidate_neighbours is not None:
+            if candidate_neighbours < 1:
+                raise GameInitiationError("candidate_neighbours needs to be at least 1.")
+            # one bitmask of neighbours per city, shared by all clones
+            self._candidate_masks = [sum(1 << int(neighbour) for neighbour in neighbours)
+                                     for neighbours in self.city_grid.nearest_neighbours(candidate_neighbours)]
+        # length of the tour up to and including each city of _tour, so that undo needs no subtraction
+        self._tour_lengths = []
+        for position, index in enumerate(self._tour):
+            leg = self._distances[self._tour[position - 1], index] if position else 0.
+            self._tour_lengths.append(self.tour_length + float(leg))
 
-    def _check_game_correctly_initiated(self):
-        duplicates = set([city for city in self.possible_moves if self.possible_moves.count(city) > 1])
+    @property
+    def tour_length(self) -> float:
+        """ Distance travelled so far in km, NaN if the tour passes a city without known coordinates"""
+        return self._tour_lengths[-1] if self._tour_lengths else 0.
+
+    @property
+    def possible_moves(self) -> List[str]:
+        """ Cities still to visit, in the order they were given"""
+        names = []
+        remaining = self._remaining
+        while remaining:
+            lowest = remaining & -remaining
+            names.append(self._city_names[lowest.bit_length() - 1])
+            remaining ^= lowest
+        return names
+
+    @possible_moves.setter
+    def possible_moves(self, cities: List[str]):
+        self._remaining = 0
+        if cities is None:
+            return
+        duplicates = set([city for city in cities if cities.count(city) > 1])
         if len(duplicates) != 0:
             raise GameInitiationError("Found the following duplicates in possible moves: {dups}".format(dups=duplicates))
+        for city in cities:
+            self._remaining |= 1 << self.city_grid.city_index[city]
+
+    def _check_game_correctly_initiated(self):
         if not isinstance(self.root, str) or not len(self.root):
             raise GameInitiationError("Home Town needs to be a string with at least one characater.")
 
     def _check_game_over(self):
-        if len(self.possible_moves) == 0:
-            return True
-        return False
+        return self._remaining == 0
+
+    def _legal_moves_mask(self) -> int:
+        """ Bitmask of the cities that can be visited next
+
+        The home town is only allowed once it is the last city left, no other city may be visited twice.
+        """
+        if self._remaining == self._root_bit:
+            return self._remaining
+        return self._remaining & ~self._visited & ~self._root_bit
 
     def _check_move_possible(self, move: str):
         """ Check if move is allowed
@@ -78,31 +355,33 @@ class TravelingTourist(Game):
         :param move: city name
         :return:
         """
-        if self._check_game_over():
-            return False
-
-        if move == self.root:
-            # only allowed if all other cities have been visited
-            if len(self.possible_moves) == 1 and self.possible_moves[0] == self.root:
-                return True
-            else:
-                return False
-        elif move in self.current_game_state:
-            # City has already been visited
-            return False
-        elif move not in self.possible_moves:
+        index = self.city_grid.city_index.get(move)
+        if index is None:
             # not planned to visit this city
             return False
-        else:
-            return True
+        return bool(self._legal_moves_mask() >> index & 1)
+
+    def _next_moves_mask(self) -> int:
+        """ _legal_moves_mask() restricted to the unvisited candidates of the current city, if there are any"""
+        legal = self._legal_moves_mask()
+        if self._candidate_masks is not None and self._tour:
+            legal = legal & self._candidate_masks[self._tour[-1]] or legal
+        return legal
 
     def generate_next_moves(self) -> List[str]:
         """ Generates a list of possible next cities to visit
 
-        If all cities have been visited, next city will be the root city
+        If all cities have been visited, next city will be the root city.
+        With candidate_neighbours only the unvisited candidates of the current city are offered, if there are any.
         :return: city name
         """
-        return list(filter(lambda move: self._check_move_possible(move), self.possible_moves))
+        names = []
+        legal = self._next_moves_mask()
+        while legal:
+            lowest = legal & -legal
+            names.append(self._city_names[lowest.bit_length() - 1])
+            legal ^= lowest
+        return names
 
     def make_a_move(self, move: str):
         """ Change current_game_state and possible_moves
@@ -112,18 +391,103 @@ class TravelingTourist(Game):
         """
         if not self._check_move_possible(move):
             raise MoveNotAllowedError("Cannot make this move: '{}'.".format(move))
-        self.possible_moves.remove(move)
+        index = self.city_grid.city_index[move]
+        self._remaining &= ~(1 << index)
+        self._visits[index] += 1
+        self._visited |= 1 << index
+        leg = float(self._distances[self._tour[-1], index]) if self._tour else 0.
+        self._tour_lengths.append(self.tour_length + leg)
+        self._tour.append(index)
         self.current_game_state.append(move)
+        self._n_moves_made += 1
         return
 
+    def undo_move(self):
+        """ Revert the last move, the city is put back at its former position in possible_moves"""
+        if self._n_moves_made == 0:
+            raise GameStateError("No move left to undo.")
+        index = self._tour.pop()
+        self._tour_lengths.pop()
+        self.current_game_state.pop()
+        self._remaining |= 1 << index
+        self._visits[index] -= 1
+        if self._visits[index] == 0:
+            self._visited &= ~(1 << index)
+        self._n_moves_made -= 1
+
+    def clone(self) -> "TravelingTourist":
+        """ Copy of the game sharing the city grid"""
+        clone = copy(self)
+        clone.current_game_state = list(self.current_game_state)
+        clone._tour = list(self._tour)
+        clone._tour_lengths = list(self._tour_lengths)
+        clone._visits = list(self._visits)
+        return clone
+
+    def state_key(self) -> tuple:
+        """ Cities still to visit (as bitmask) and the current city
+
+        Two partial tours that visited the same cities and stand in the same city have the same future.
+        """
+        return self._remaining, self._tour[-1] if len(self._tour) else -1
+
+    def terminal_key(self) -> tuple:
+        """ The tour, its length depends on the order of the cities"""
+        return tuple(self.current_game_state)
+
+    def order_moves(self, moves: List[str]) -> List[str]:
+        """ Cities closest to the current city first"""
+        current_city = self.current_game_state[-1]
+        return sorted(moves, key=lambda move: self.city_grid.distance_between_two_cities(current_city, move))
+
+    def widening_order(self) -> Iterator[str]:
+        """ Lazy order_moves(generate_next_moves()), walking the cities by distance from the current city"""
+        if not self._tour:
+            return super(TravelingTourist, self).widening_order()
+        legal = self._next_moves_mask()
+        names = self._city_names
+        return (names[index] for index in self.city_grid.cities_by_distance(self._tour[-1]) if legal >> index & 1)
+
+    def reward(self, evaluation: float) -> float:
+        """ Shorter tours are better, the reward is how much shorter than the longest possible tour it is"""
+        return self._longest_tour - evaluation
+
+    def rollout_batch(self, n_rollouts: int, rng, return_best: bool = False):
+        """ Tour lengths of n_rollouts uniformly random completions of the tour, played with array operations
+
+        Every remaining city is equally likely at every step, candidate_neighbours is not taken into account.
+        :param rng: RandomStream of the search
+        :param return_best: also return the shortest completed tour
+        :return: array of tour lengths, and the shortest tour as list of city names if return_best
+        """
+        cities = []
+        remaining = self._remaining & ~self._root_bit
+        while remaining:
+            lowest = remaining & -remaining
+            cities.append(lowest.bit_length() - 1)
+            remaining ^= lowest
+        # sorting uniform variates gives a uniformly random permutation per row
+        orders = np.argsort(rng.generator.random((n_rollouts, len(cities))), axis=1)
+        completions = np.array(cities, dtype=np.int64)[orders]
+        if self._remaining & self._root_bit:
+            root_column = np.full((n_rollouts, 1), self.city_grid.city_index[self.root], dtype=np.int64)
+            completions = np.hstack([completions, root_column])
+        tours = completions
+        if self._tour:
+            tours = np.hstack([np.full((n_rollouts, 1), self._tour[-1], dtype=np.int64), completions])
+        lengths = self.tour_length + self._distances[tours[:, :-1], tours[:, 1:]].sum(axis=1)
+        if np.isnan(lengths).any():
+            # raises for the unknown city
+            self.city_grid.tour_length(self._tour + completions[int(np.argmax(np.isnan(lengths)))].tolist())
+        if not return_best:
+            return lengths
+        best = int(np.argmin(lengths))
+        return lengths, self.current_game_state + [self._city_names[index] for index in completions[best]]
+
     def evaluate_game(self):
         if not self._check_game_over():
             raise GameStateError("Game has not been terminated")
-        total_distance = 0
-        for i in range(len(self.current_game_state) - 1):
-            # TODO: Can be done more elegantly with a map reduce
-            city1 = self.current_game_state[i]
-            city2 = self.current_game_state[i + 1]
-            distance = self.city_grid.distance_between_two_cities(city1, city2)
-            total_distance += distance
-        return total_distance
+        if np.isnan(self.tour_length):
+            # the full computation raises for the unknown city
+            return self.city_grid.tour_length(self._tour)
+        return self.tour_length
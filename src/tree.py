@@ -1,12 +1,800 @@
+import json
+import os
+from itertools import islice
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
 class Tree(dict):
     def __missing__(self, key):
         value = self[key] = type(self)()
         return value
 
 
+class SearchTreeState(object):
+    """ Bookkeeping shared by all nodes of one SearchTree"""
+    __slots__ = ("node_count", "clock", "max_nodes", "eviction_policy", "evictions", "evicted_nodes")
+
+    def __init__(self, max_nodes: int = None, eviction_policy: str = "lru"):
+        self.node_count = 0
+        self.clock = 0
+        self.max_nodes = max_nodes
+        self.eviction_policy = eviction_policy
+        self.evictions = 0
+        self.evicted_nodes = 0
+
+
 class SearchTree(Tree):
-    def __init__(self):
+    eviction_policies = ("lru", "visits")
+    eviction_low_water = 0.9
+    # child statistics are gathered from the child nodes one by one, see ArrayTree
+    columnar_statistics = False
+
+    def __init__(self, max_nodes: int = None, eviction_policy: str = "lru", state: SearchTreeState = None):
+        """
+        :param max_nodes: node budget, evict() brings the tree back below it
+        :param eviction_policy: "lru" evicts the least recently visited subtrees first, "visits" the least visited
+        :param state: bookkeeping of the tree a new node belongs to, None creates a new tree
+        """
         super(SearchTree, self).__init__()
-        self.average_path_value = None
         self.passes = 0
+        self.value_sum = 0.
+        self.sum_of_squares = 0.
         self.full_path = []
+        if state is None:
+            if eviction_policy not in self.eviction_policies:
+                raise ValueError("eviction_policy needs to be one of {options}".format(options=self.eviction_policies))
+            state = SearchTreeState(max_nodes, eviction_policy)
+        self._state = state
+        self.last_visit = state.clock
+
+    def __missing__(self, key):
+        value = self[key] = type(self)(state=self._state)
+        self._state.node_count += 1
+        return value
+
+    @property
+    def node_count(self) -> int:
+        """ Number of nodes created in the tree this node belongs to"""
+        return self._state.node_count
+
+    @property
+    def evictions(self) -> int:
+        return self._state.evictions
+
+    @property
+    def evicted_nodes(self) -> int:
+        return self._state.evicted_nodes
+
+    @property
+    def over_budget(self) -> bool:
+        return self._state.max_nodes is not None and self._state.node_count > self._state.max_nodes
+
+    def tick(self):
+        """ Advance the clock used to record when nodes were last visited"""
+        self._state.clock += 1
+
+    def _subtree_size(self) -> int:
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for child in node.values():
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+        return len(seen)
+
+    def _evictable_families(self) -> List["SearchTree"]:
+        """ Nodes below the top whose children are all leaves"""
+        families = []
+        seen = set()
+        stack = list(self.values())
+        while stack:
+            node = stack.pop()
+            if id(node) in seen or not len(node):
+                continue
+            seen.add(id(node))
+            children = list(node.values())
+            if all(not len(child) for child in children):
+                families.append(node)
+            else:
+                stack.extend(children)
+        return families
+
+    def evict(self) -> int:
+        """ Drop cold subtrees until the tree is below its node budget again
+
+        Only whole sets of children are dropped, so the parent becomes a leaf and is expanded again when
+        the search comes back. The statistics of the dropped nodes are already part of their parent's
+        statistics, since every simulation through a child also passed its parent.
+        Called on the tree object itself.
+
+        :return: number of nodes evicted
+        """
+        if self._state.max_nodes is None:
+            return 0
+        target = int(self.eviction_low_water * self._state.max_nodes)
+        node_count = self._subtree_size()
+        evicted = 0
+        while node_count > target:
+            families = self._evictable_families()
+            if not len(families):
+                break
+            if self._state.eviction_policy == "lru":
+                families.sort(key=lambda node: node.last_visit)
+            else:
+                families.sort(key=lambda node: node.passes)
+            for node in families:
+                if node_count <= target:
+                    break
+                node_count -= len(node)
+                evicted += len(node)
+                node.clear()
+        self._state.node_count = self._subtree_size()
+        self._state.evictions += 1
+        self._state.evicted_nodes += evicted
+        return evicted
+
+    def link(self, move, node: "SearchTree"):
+        """ Make an existing node the child reached by move, the node is then shared by several parents"""
+        self[move] = node
+
+    def add_children(self, moves: List):
+        """ Create the children reached by moves that do not exist yet"""
+        for move in moves:
+            self[move]
+
+    def reroot(self, root_move, move):
+        """ Make the child reached by move from the root the new root
+
+        Called on the tree object itself (the node holding the root). The siblings of the new root
+        are dropped together with the old root, so their memory is released right away.
+        """
+        new_root = self[root_move][move]
+        self.clear()
+        self[move] = new_root
+        self._state.node_count = self._subtree_size()
+
+    def to_store(self) -> "FlatNodeStore":
+        """ Copy the tree into a FlatNodeStore, breadth first, shared nodes become rows linking to their first row"""
+        store = FlatNodeStore(capacity=self._subtree_size() + 1, track_variance=True)
+        store.new_node(-1, None)
+        store.clock = self._state.clock
+        rows = {id(self): 0}
+        queue = [self]
+        for node in queue:
+            for move, child in node.items():
+                row = store.new_node(rows[id(node)], move)
+                if id(child) in rows:
+                    store.alias[row] = rows[id(child)]
+                    store.n_links += 1
+                    continue
+                rows[id(child)] = row
+                store.passes[row] = child.passes
+                store.value_sum[row] = child.value_sum
+                store.sum_of_squares[row] = child.sum_of_squares
+                store.last_visit[row] = child.last_visit
+                queue.append(child)
+        return store
+
+    def save(self, path: str):
+        """ Write the tree to the directory path in the columnar format of ArrayTree.save
+
+        Called on the tree object itself. The file can be loaded with either SearchTree.load or ArrayTree.load.
+        """
+        self.to_store().save(path, {"max_nodes": self._state.max_nodes,
+                                    "eviction_policy": self._state.eviction_policy,
+                                    "evictions": self._state.evictions,
+                                    "evicted_nodes": self._state.evicted_nodes})
+
+    @classmethod
+    def load(cls, path: str) -> "SearchTree":
+        """ Build a tree from a directory written by save()
+
+        The columns are memory mapped while the nodes are created, so only the dict nodes are held in memory.
+        """
+        store, metadata = FlatNodeStore.load(path, mmap_mode="r")
+        tree = cls(max_nodes=metadata["max_nodes"], eviction_policy=metadata["eviction_policy"])
+        state = tree._state
+        state.clock = store.clock
+        state.evictions = metadata["evictions"]
+        state.evicted_nodes = metadata["evicted_nodes"]
+        nodes = [tree]
+        for row in range(1, store.size):
+            node = cls(state=state)
+            node.passes = int(store.passes[row])
+            node.value_sum = float(store.value_sum[row])
+            if store.track_variance:
+                node.sum_of_squares = float(store.sum_of_squares[row])
+            node.last_visit = int(store.last_visit[row])
+            nodes.append(node)
+        # links are resolved in a second pass since a row may link to a row stored after it
+        for row in range(1, store.size):
+            move = store.moves[store.move_id[row]]
+            nodes[store.parent[row]][move] = nodes[store.resolve(row)]
+        state.node_count = store.size - 1 - store.n_links
+        return tree
+
+    def update(self, simulation_evaluation: float):
+        self.passes += 1
+        self.value_sum += simulation_evaluation
+        self.sum_of_squares += simulation_evaluation * simulation_evaluation
+        self.last_visit = self._state.clock
+
+    @property
+    def average_path_value(self):
+        if self.passes == 0:
+            return None
+        return self.value_sum / self.passes
+
+    @property
+    def variance(self):
+        if self.passes == 0:
+            return None
+        return max(self.sum_of_squares / self.passes - (self.value_sum / self.passes) ** 2, 0.)
+
+    @property
+    def node_id(self) -> int:
+        return id(self)
+
+    def merge(self, passes: int, value_sum: float, sum_of_squares: float = 0.):
+        """ Add statistics gathered by another search for the same node"""
+        self.passes += passes
+        self.value_sum += value_sum
+        self.sum_of_squares += sum_of_squares
+        self.last_visit = self._state.clock
+
+    def add_virtual_loss(self, magnitude: float):
+        """ Count a pending simulation as a visit with value -magnitude"""
+        self.merge(1, -magnitude, magnitude * magnitude)
+
+    def revert_virtual_loss(self, magnitude: float):
+        self.merge(-1, magnitude, -magnitude * magnitude)
+
+    def child_statistics(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Passes and average values of all children, in insertion order (0 for unvisited children)"""
+        n = len(self)
+        passes = np.fromiter((child.passes for child in self.values()), dtype=np.int64, count=n)
+        averages = np.fromiter((child.average_path_value or 0. for child in self.values()), dtype=np.float64, count=n)
+        return passes, averages
+
+    def child_move(self, position: int):
+        return next(islice(self.keys(), position, None))
+
+
+class FlatNodeStore(object):
+    """ Growable column store holding all nodes of an ArrayTree
+
+    Every node is a row index into the arrays below. Children of a node are linked through
+    first_child / next_sibling. Children created one after another (as expand() does) end up
+    in one contiguous block, which keeps traversal cache friendly.
+    """
+    initial_capacity = 1024
+    # a smaller factor than doubling keeps the unused tail of the columns small
+    growth_factor = 1.25
+
+    def __init__(self, capacity: int = None, track_variance: bool = False):
+        capacity = capacity or self.initial_capacity
+        self.track_variance = track_variance
+        self.size = 0
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.next_sibling = np.full(capacity, -1, dtype=np.int32)
+        self.n_children = np.zeros(capacity, dtype=np.int32)
+        self.fragmented = np.zeros(capacity, dtype=np.bool_)
+        self.move_id = np.full(capacity, -1, dtype=np.int32)
+        self.alias = np.full(capacity, -1, dtype=np.int32)
+        self.passes = np.zeros(capacity, dtype=np.int32)
+        self.value_sum = np.zeros(capacity, dtype=np.float64)
+        self.sum_of_squares = np.zeros(capacity, dtype=np.float64) if track_variance else None
+        self.last_visit = np.zeros(capacity, dtype=np.int32)
+        self.moves = []
+        self.move_ids = {}
+        self.n_links = 0
+        self.clock = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.parent)
+
+    @property
+    def columns(self) -> List[str]:
+        columns = ["parent", "first_child", "next_sibling", "n_children", "fragmented", "move_id", "alias", "passes",
+                   "value_sum", "last_visit"]
+        if self.track_variance:
+            columns.append("sum_of_squares")
+        return columns
+
+    index_columns = ("parent", "first_child", "next_sibling", "move_id", "alias")
+
+    def _empty_column(self, column: str, capacity: int) -> np.ndarray:
+        dtype = getattr(self, column).dtype
+        if column in self.index_columns:
+            return np.full(capacity, -1, dtype=dtype)
+        return np.zeros(capacity, dtype=dtype)
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes used by the node columns (allocated capacity, not only used rows)"""
+        return sum(getattr(self, column).nbytes for column in self.columns)
+
+    def _grow(self):
+        old_capacity = self.capacity
+        new_capacity = max(int(old_capacity * self.growth_factor), old_capacity + 1)
+        for column in self.columns:
+            try:
+                # reallocates in place, the old and the new column are never held at the same time
+                getattr(self, column).resize(new_capacity)
+            except ValueError:
+                # memory-mapped or referenced elsewhere, copy instead
+                new = self._empty_column(column, new_capacity)
+                new[:self.size] = getattr(self, column)[:self.size]
+                setattr(self, column, new)
+                continue
+            if column in self.index_columns:
+                getattr(self, column)[old_capacity:] = -1
+
+    def subtree_mask(self, node: int) -> np.ndarray:
+        """ Boolean mask over all rows that are node or one of its descendants, including linked nodes"""
+        parent = self.parent[:self.size]
+        alias = self.alias[:self.size]
+        mask = np.zeros(self.size, dtype=np.bool_)
+        mask[node] = True
+        has_parent = parent >= 0
+        # every pass adds one more level of children and the nodes linked from the rows found so far
+        while True:
+            extended = mask.copy()
+            extended[has_parent] |= mask[parent[has_parent]]
+            linked = alias[extended & (alias >= 0)]
+            extended[linked] = True
+            if (extended == mask).all():
+                return mask
+            mask = extended
+
+    def save(self, path: str, metadata: Dict = None):
+        """ Write the used rows of every column to path/<column>.npy and the move table to path/tree.json
+
+        :param path: directory, created if it does not exist
+        :param metadata: additional JSON serializable entries for tree.json
+        """
+        os.makedirs(path, exist_ok=True)
+        # the columns may be memory mapped from the files being replaced (a tree loaded from path), so every
+        # file is written next to its target first and only moved into place once all of them are written
+        written = []
+        for column in self.columns:
+            file_path = os.path.join(path, column + ".npy")
+            with open(file_path + ".tmp", "wb") as f:
+                np.save(f, getattr(self, column)[:self.size])
+            written.append(file_path)
+        header = dict(metadata or {})
+        header.update({"size": self.size, "moves": self.moves, "n_links": self.n_links, "clock": self.clock,
+                       "track_variance": self.track_variance})
+        file_path = os.path.join(path, "tree.json")
+        with open(file_path + ".tmp", "w") as f:
+            json.dump(header, f)
+        written.append(file_path)
+        for file_path in written:
+            os.replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "c") -> Tuple["FlatNodeStore", Dict]:
+        """ Open a store written by save()
+
+        :param mmap_mode: passed on to np.load, "c" maps the columns copy-on-write so that they can be modified
+        without touching the files, None reads them into memory
+        :return: the store and the content of tree.json
+        """
+        with open(os.path.join(path, "tree.json")) as f:
+            header = json.load(f)
+        store = cls(capacity=1, track_variance=header["track_variance"])
+        for column in store.columns:
+            setattr(store, column, np.load(os.path.join(path, column + ".npy"), mmap_mode=mmap_mode))
+        store.size = header["size"]
+        store.moves = header["moves"]
+        store.move_ids = {move: move_id for move_id, move in enumerate(store.moves)}
+        store.n_links = header["n_links"]
+        store.clock = header["clock"]
+        return store, header
+
+    def resolve(self, index: int) -> int:
+        """ Row holding the statistics of index, which differs for rows linking to a shared node"""
+        target = self.alias[index]
+        return index if target == -1 else int(target)
+
+    def compact(self, keep: np.ndarray):
+        """ Drop all rows not in keep and renumber the remaining ones, the arrays are reallocated
+
+        Rows whose parent is dropped become roots (parent -1) unless their parent was changed beforehand.
+        """
+        new_index = np.cumsum(keep) - 1
+        size = int(keep.sum())
+        capacity = max(self.initial_capacity, 2 * size)
+        old_parent = self.parent[:self.size][keep]
+        kept_parent = old_parent >= 0
+        kept_parent[kept_parent] = keep[old_parent[kept_parent]]
+        for column in self.columns:
+            new = self._empty_column(column, capacity)
+            new[:size] = getattr(self, column)[:self.size][keep]
+            setattr(self, column, new)
+        self.parent[:size] = np.where(kept_parent, new_index[np.maximum(old_parent, 0)], -1)
+        alias = self.alias[:size]
+        # rows linking to a dropped node turn into plain (unvisited) nodes
+        kept_alias = alias >= 0
+        kept_alias[kept_alias] = keep[alias[kept_alias]]
+        self.alias[:size] = np.where(kept_alias, new_index[np.maximum(alias, 0)], -1)
+        self.n_links = int(kept_alias.sum())
+        self.size = size
+        self._rebuild_links()
+
+    def _rebuild_links(self):
+        """ Recompute first_child, next_sibling, n_children and fragmented from the parent column
+
+        Siblings keep their order because a child is always stored after the siblings created before it.
+        """
+        n = self.size
+        parent = self.parent[:n]
+        self.first_child[:n] = -1
+        self.next_sibling[:n] = -1
+        self.n_children[:n] = 0
+        self.fragmented[:n] = False
+        order = np.argsort(parent, kind="stable")
+        order = order[parent[order] >= 0]
+        if not len(order):
+            return
+        sorted_parent = parent[order]
+        same_parent = sorted_parent[1:] == sorted_parent[:-1]
+        self.next_sibling[order[:-1][same_parent]] = order[1:][same_parent]
+        starts = np.flatnonzero(np.r_[True, ~same_parent])
+        ends = np.flatnonzero(np.r_[~same_parent, True])
+        parents = sorted_parent[starts]
+        counts = ends - starts + 1
+        self.first_child[parents] = order[starts]
+        self.n_children[parents] = counts
+        self.fragmented[parents] = order[ends] - order[starts] + 1 != counts
+
+    def encode_move(self, move) -> int:
+        move_id = self.move_ids.get(move)
+        if move_id is None:
+            move_id = self.move_ids[move] = len(self.moves)
+            self.moves.append(move)
+        return move_id
+
+    def new_node(self, parent: int, move) -> int:
+        if self.size == self.capacity:
+            self._grow()
+        index = self.size
+        self.size += 1
+        self.parent[index] = parent
+        self.last_visit[index] = self.clock
+        self.move_id[index] = self.encode_move(move) if parent >= 0 else -1
+        if parent >= 0:
+            self._link_child(parent, index)
+        return index
+
+    def _link_child(self, parent: int, child: int):
+        n = self.n_children[parent]
+        if n == 0:
+            self.first_child[parent] = child
+        else:
+            last = self.last_child(parent)
+            self.next_sibling[last] = child
+            if child != self.first_child[parent] + n:
+                self.fragmented[parent] = True
+        self.n_children[parent] = n + 1
+
+    def last_child(self, node: int) -> int:
+        if not self.fragmented[node]:
+            return self.first_child[node] + self.n_children[node] - 1
+        child = self.first_child[node]
+        while self.next_sibling[child] != -1:
+            child = self.next_sibling[child]
+        return child
+
+    def children(self, node: int) -> np.ndarray:
+        """ Row indices of all children of node, in insertion order"""
+        first = self.first_child[node]
+        if not self.fragmented[node]:
+            return np.arange(first, first + self.n_children[node], dtype=np.int32)
+        indices = []
+        child = first
+        while child != -1:
+            indices.append(child)
+            child = self.next_sibling[child]
+        return np.array(indices, dtype=np.int32)
+
+    def find_child(self, node: int, move) -> int:
+        """ Row index of the child reached by move or -1 if it does not exist"""
+        move_id = self.move_ids.get(move)
+        n = int(self.n_children[node])
+        if move_id is None or n == 0:
+            return -1
+        if self.fragmented[node]:
+            children = self.children(node)
+            hits = np.flatnonzero(self.move_id[children] == move_id)
+            return int(children[hits[0]]) if len(hits) else -1
+        # contiguous children: scan a slice instead of gathering rows
+        first = int(self.first_child[node])
+        position = int((self.move_id[first:first + n] == move_id).argmax())
+        return first + position if self.move_id[first + position] == move_id else -1
+
+    def resolve_all(self, indices: np.ndarray) -> np.ndarray:
+        """ resolve() for several rows at once"""
+        alias = self.alias[indices]
+        return np.where(alias >= 0, alias, indices)
+
+
+class ArrayTreeNode(object):
+    """ Lightweight view on one row of a FlatNodeStore
+
+    Exposes the same interface as a SearchTree node (item access creating missing children,
+    keys(), passes and average_path_value) so that MonteCarloTreeSearch can use both trees.
+    """
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: FlatNodeStore, index: int):
+        self.store = store
+        self.index = index
+
+    def __repr__(self):
+        return "<ArrayTreeNode {index} with {n} child(ren)>".format(index=self.index, n=len(self))
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayTreeNode) and other.store is self.store and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    def __len__(self):
+        return int(self.store.n_children[self.index])
+
+    def __contains__(self, move):
+        return self.store.find_child(self.index, move) != -1
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, move):
+        child = self.store.find_child(self.index, move)
+        if child == -1:
+            child = self.store.new_node(self.index, move)
+        return ArrayTreeNode(self.store, self.store.resolve(child))
+
+    def get(self, move, default=None):
+        child = self.store.find_child(self.index, move)
+        if child == -1:
+            return default
+        return ArrayTreeNode(self.store, self.store.resolve(child))
+
+    def link(self, move, node: "ArrayTreeNode"):
+        """ Make an existing node the child reached by move, the node is then shared by several parents"""
+        child = self.store.find_child(self.index, move)
+        if child == -1:
+            child = self.store.new_node(self.index, move)
+        if self.store.alias[child] == -1:
+            self.store.n_links += 1
+        self.store.alias[child] = node.index
+
+    def add_children(self, moves: List):
+        """ Create the children reached by moves that do not exist yet, existing children are looked up once"""
+        existing = set(self.keys()) if len(self) else ()
+        for move in moves:
+            if move not in existing:
+                self.store.new_node(self.index, move)
+
+    def keys(self) -> List:
+        moves = self.store.moves
+        return [moves[move_id] for move_id in self.store.move_id[self.store.children(self.index)].tolist()]
+
+    def values(self) -> List["ArrayTreeNode"]:
+        store = self.store
+        return [ArrayTreeNode(store, row) for row in store.resolve_all(store.children(self.index)).tolist()]
+
+    def items(self):
+        store = self.store
+        children = store.children(self.index)
+        moves = store.moves
+        return [(moves[move_id], ArrayTreeNode(store, row))
+                for move_id, row in zip(store.move_id[children].tolist(), store.resolve_all(children).tolist())]
+
+    @property
+    def move(self):
+        move_id = self.store.move_id[self.index]
+        return None if move_id == -1 else self.store.moves[move_id]
+
+    @property
+    def passes(self) -> int:
+        return int(self.store.passes[self.index])
+
+    @property
+    def value_sum(self) -> float:
+        return float(self.store.value_sum[self.index])
+
+    @property
+    def average_path_value(self):
+        passes = self.store.passes[self.index]
+        if passes == 0:
+            return None
+        return float(self.store.value_sum[self.index] / passes)
+
+    @property
+    def sum_of_squares(self) -> float:
+        if not self.store.track_variance:
+            return 0.
+        return float(self.store.sum_of_squares[self.index])
+
+    @property
+    def variance(self):
+        """ Variance of the evaluations, only available for trees created with track_variance"""
+        passes = self.store.passes[self.index]
+        if passes == 0 or not self.store.track_variance:
+            return None
+        mean = self.store.value_sum[self.index] / passes
+        return max(float(self.store.sum_of_squares[self.index] / passes - mean * mean), 0.)
+
+    def child_statistics(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Passes and average values of all children, in insertion order (0 for unvisited children)"""
+        children = self.store.resolve_all(self.store.children(self.index))
+        passes = self.store.passes[children]
+        averages = np.divide(self.store.value_sum[children], passes, out=np.zeros(len(children)), where=passes > 0)
+        return passes, averages
+
+    def child_move(self, position: int):
+        child = self.store.children(self.index)[position]
+        return self.store.moves[self.store.move_id[child]]
+
+    def update(self, simulation_evaluation: float):
+        self.store.passes[self.index] += 1
+        self.store.value_sum[self.index] += simulation_evaluation
+        if self.store.track_variance:
+            self.store.sum_of_squares[self.index] += simulation_evaluation * simulation_evaluation
+        self.store.last_visit[self.index] = self.store.clock
+
+    @property
+    def node_id(self) -> int:
+        return self.index
+
+    def merge(self, passes: int, value_sum: float, sum_of_squares: float = 0.):
+        """ Add statistics gathered by another search for the same node"""
+        self.store.passes[self.index] += passes
+        self.store.value_sum[self.index] += value_sum
+        if self.store.track_variance:
+            self.store.sum_of_squares[self.index] += sum_of_squares
+        self.store.last_visit[self.index] = self.store.clock
+
+    def add_virtual_loss(self, magnitude: float):
+        """ Count a pending simulation as a visit with value -magnitude"""
+        self.merge(1, -magnitude, magnitude * magnitude)
+
+    def revert_virtual_loss(self, magnitude: float):
+        self.merge(-1, magnitude, -magnitude * magnitude)
+
+    @property
+    def full_path(self) -> List:
+        path = []
+        index = self.index
+        while self.store.parent[index] != -1:
+            path.append(self.store.moves[self.store.move_id[index]])
+            index = self.store.parent[index]
+        return path[::-1]
+
+
+class ArrayTree(ArrayTreeNode):
+    """ Search tree keeping all nodes in flat NumPy columns instead of one dict per node
+
+    Drop-in replacement for SearchTree: tree[root][move] creates missing nodes, nodes expose
+    passes and average_path_value. Statistics are stored as visit counts and value sums.
+    """
+    eviction_policies = SearchTree.eviction_policies
+    eviction_low_water = SearchTree.eviction_low_water
+    # child_statistics() slices the columns of the store, which makes vectorized selection pay off
+    columnar_statistics = True
+
+    def __init__(self, capacity: int = None, track_variance: bool = False, max_nodes: int = None,
+                 eviction_policy: str = "lru"):
+        """
+        :param capacity: number of rows allocated up front, the columns grow by growth_factor when full
+        :param track_variance: also keep the sum of squared evaluations per node
+        :param max_nodes: node budget, evict() brings the tree back below it
+        :param eviction_policy: "lru" evicts the least recently visited subtrees first, "visits" the least visited
+        """
+        if eviction_policy not in self.eviction_policies:
+            raise ValueError("eviction_policy needs to be one of {options}".format(options=self.eviction_policies))
+        super(ArrayTree, self).__init__(FlatNodeStore(capacity, track_variance), 0)
+        self.store.new_node(-1, None)
+        self.max_nodes = max_nodes
+        self.eviction_policy = eviction_policy
+        self.evictions = 0
+        self.evicted_nodes = 0
+
+    @property
+    def node_count(self) -> int:
+        """ Number of nodes, not counting the internal top node holding the root(s) and rows linking to shared nodes"""
+        return self.store.size - 1 - self.store.n_links
+
+    def reroot(self, root_move, move):
+        """ Make the child reached by move from the root the new root
+
+        All other rows are dropped and the columns are reallocated, so their memory is released right away.
+        Node views taken before are no longer valid afterwards.
+        """
+        new_root = self[root_move][move].index
+        keep = self.store.subtree_mask(new_root)
+        keep[0] = True
+        self.store.parent[new_root] = 0
+        self.store.compact(keep)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.max_nodes is not None and self.node_count > self.max_nodes
+
+    def save(self, path: str):
+        """ Write the tree to the directory path, one .npy file per column plus tree.json holding the moves
+
+        Moves are stored in JSON, so they need to be strings or numbers.
+        """
+        self.store.save(path, {"max_nodes": self.max_nodes,
+                               "eviction_policy": self.eviction_policy,
+                               "evictions": self.evictions,
+                               "evicted_nodes": self.evicted_nodes})
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "c") -> "ArrayTree":
+        """ Open a tree written by save() (of either tree class)
+
+        With the default mmap_mode the columns are memory mapped copy-on-write: opening takes the same time
+        for any tree size, pages are read when the search touches them and the files are never modified.
+        The columns are copied into memory once the tree grows.
+        """
+        store, metadata = FlatNodeStore.load(path, mmap_mode)
+        tree = cls(capacity=1, max_nodes=metadata["max_nodes"], eviction_policy=metadata["eviction_policy"])
+        tree.store = store
+        tree.evictions = metadata["evictions"]
+        tree.evicted_nodes = metadata["evicted_nodes"]
+        return tree
+
+    def tick(self):
+        """ Advance the clock used to record when nodes were last visited"""
+        self.store.clock += 1
+
+    def evict(self) -> int:
+        """ Drop cold subtrees until the tree is below its node budget again
+
+        Works like SearchTree.evict: only whole sets of leaf children are dropped and their parent becomes
+        a leaf again. Node views taken before are no longer valid afterwards.
+
+        :return: number of nodes evicted
+        """
+        if self.max_nodes is None:
+            return 0
+        store = self.store
+        target = int(self.eviction_low_water * self.max_nodes)
+        node_count = start_count = self.node_count
+        while node_count > target:
+            n = store.size
+            parent = store.parent[:n]
+            n_children = store.n_children[:n]
+            inner = np.flatnonzero(n_children > 0)
+            inner_children = np.bincount(parent[inner[parent[inner] >= 0]], minlength=n)
+            candidates = np.flatnonzero((n_children > 0) & (inner_children == 0))
+            candidates = candidates[candidates > 0]
+            if not len(candidates):
+                break
+            key = store.last_visit if self.eviction_policy == "lru" else store.passes
+            candidates = candidates[np.argsort(key[candidates], kind="stable")]
+            dropped = np.cumsum(n_children[candidates])
+            n_families = min(int(np.searchsorted(dropped, node_count - target)) + 1, len(candidates))
+            family = np.zeros(n, dtype=np.bool_)
+            family[candidates[:n_families]] = True
+            keep = np.ones(n, dtype=np.bool_)
+            keep[parent >= 0] = ~family[parent[parent >= 0]]
+            store.compact(keep)
+            node_count = self.node_count
+        self.evictions += 1
+        self.evicted_nodes += start_count - node_count
+        return start_count - node_count
+
+    @property
+    def nbytes(self) -> int:
+        return self.store.nbytes
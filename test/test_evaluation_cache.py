@@ -0,0 +1,50 @@
+import unittest
+import unittest.mock as mock
+
+from evaluation_cache import EvaluationCache
+from monte_carlo import MonteCarloTreeSearch
+from traveling_tourist import TravelingTourist
+from tree import SearchTree
+
+
+class TestEvaluationCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = EvaluationCache(max_size=2)
+
+    def test_lru_eviction(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.assertEqual(self.cache.get("a"), 1)
+        # "b" is now the least recently used entry
+        self.cache.put("c", 3)
+        self.assertNotIn("b", self.cache)
+        self.assertIs(self.cache.get("b"), EvaluationCache.missing)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.assertAlmostEqual(self.cache.hit_rate, 2 / 3)
+        with self.assertRaises(ValueError):
+            EvaluationCache(max_size=0)
+
+    def test_search_reuses_evaluations(self):
+        trees = []
+        for cache in [None, EvaluationCache(max_size=1000)]:
+            traveling_tourist = TravelingTourist(possible_moves=["Berlin", "Lisbon", "Hamburg", "Madrid", "Copenhagen"],
+                                                 home_town="Berlin",
+                                                 current_game_state=["Berlin"])
+            m = MonteCarloTreeSearch(game_object=traveling_tourist, tree_object=SearchTree(), seed=3,
+                                     evaluation_cache=cache, rollouts_per_leaf=2)
+            with mock.patch.object(TravelingTourist, "evaluate_game", autospec=True,
+                                   side_effect=TravelingTourist.evaluate_game) as evaluate_game:
+                m.make_iteration(100)
+            trees.append(m.search_tree)
+        # 4! tours starting in Berlin, every one is evaluated once
+        self.assertLessEqual(evaluate_game.call_count, 24)
+        self.assertEqual(evaluate_game.call_count, len(cache))
+        self.assertEqual(cache.hits + cache.misses, 200)
+        self.assertGreater(cache.hit_rate, 0.7)
+        self.assertEqual(trees[0]["Berlin"].passes, trees[1]["Berlin"].passes)
+        self.assertAlmostEqual(trees[0]["Berlin"].value_sum, trees[1]["Berlin"].value_sum)
+
+    def tearDown(self):
+        self.cache = None
@@ -0,0 +1,50 @@
+import json
+import unittest
+
+from instrumentation import SearchInstrumentation
+from monte_carlo import MonteCarloTreeSearch
+from traveling_tourist import TravelingTourist
+from tree import SearchTree
+
+
+class TestSearchInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.traveling_tourist = TravelingTourist(possible_moves=["Berlin", "Lisbon", "Hamburg", "Madrid", "Copenhagen"],
+                                                  home_town="Berlin",
+                                                  current_game_state=["Berlin"])
+        self.snapshots = []
+        self.instrumentation = SearchInstrumentation(callback=self.snapshots.append, callback_interval=5)
+        self.m = MonteCarloTreeSearch(game_object=self.traveling_tourist, tree_object=SearchTree(),
+                                      instrumentation=self.instrumentation)
+
+    def test_counters(self):
+        self.m.make_iteration(10)
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual(snapshot["iterations"], 10)
+        self.assertEqual(snapshot["tree_size"], self.m.search_tree.node_count)
+        # the root node was created by the first selection as well
+        self.assertEqual(snapshot["nodes_created"], self.m.search_tree.node_count)
+        self.assertEqual(snapshot["rollouts"], 10)
+        self.assertLessEqual(snapshot["max_rollout_depth"], 5)
+        self.assertGreater(snapshot["mean_rollout_depth"], 0)
+        self.assertGreater(snapshot["iterations_per_second"], 0)
+        for phase in SearchInstrumentation.phases:
+            self.assertEqual(snapshot["phases"][phase]["count"], 10)
+            self.assertEqual(sum(snapshot["phases"][phase]["histogram"]), 10)
+            self.assertGreater(snapshot["phases"][phase]["total_seconds"], 0)
+        self.assertEqual(json.loads(self.instrumentation.to_json()), snapshot)
+
+    def test_callback(self):
+        self.m.make_iteration(12)
+        self.assertListEqual([snapshot["iterations"] for snapshot in self.snapshots], [5, 10])
+
+    def test_batched_rollouts(self):
+        self.m.rollouts_per_leaf = 3
+        self.m.make_iteration(4)
+        self.assertEqual(self.instrumentation.rollouts, 12)
+        self.assertEqual(self.m.search_tree["Berlin"].passes, 12)
+        self.instrumentation.reset()
+        self.assertEqual(self.instrumentation.snapshot()["iterations"], 0)
+
+    def tearDown(self):
+        self.m = None
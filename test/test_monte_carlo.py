@@ -1,14 +1,24 @@
+import asyncio
+import tempfile
+import threading
 import unittest
 import unittest.mock as mock
+from concurrent.futures import ThreadPoolExecutor
+from itertools import permutations
 from random import Random
 from typing import List
 
+import numpy as np
+from evaluation_cache import EvaluationCache
 from helper_functions import _assert_almost_equel
 
+from instrumentation import SearchInstrumentation
 from nlg import NLGame
-from src.monte_carlo import MonteCarloTreeSearch
+from src.monte_carlo import MonteCarloTreeSearch, WideningCursor
+from random_stream import RandomStream
+from rollout import NearestNeighbourRollout
 from src.traveling_tourist import TravelingTourist
-from src.tree import SearchTree
+from src.tree import SearchTree, ArrayTree
 
 # fix random seed
 random = Random(42)
@@ -18,7 +28,7 @@ def patched_weighted_random_choice(self, choice: List[str], probability_vector:
     return choice[element]
 
 
-def patched_random_choice(list_of_elements, element=0):
+def patched_random_choice(self, list_of_elements, element=0):
     return list_of_elements[element]
 
 
@@ -36,12 +46,12 @@ class TestMonteCarloWithTSP(unittest.TestCase):
         return current_path
 
     def _mock_expand(self):
-        with mock.patch('random.choice', patched_random_choice):
+        with mock.patch.object(RandomStream, 'choice', patched_random_choice):
             expanded_path = self.m.expand()
         return expanded_path
 
     def _mock_simulate(self):
-        with mock.patch('random.choice', patched_random_choice):
+        with mock.patch.object(RandomStream, 'choice', patched_random_choice):
             evaluation = self.m.simulate()
         return evaluation
 
@@ -54,6 +64,49 @@ class TestMonteCarloWithTSP(unittest.TestCase):
         received = round(self.m.compute_upper_confidence_bound(average_value=average_value,
                                                                n_simul_node=n_simul_node), 3)
         self.assertEqual(expected, received)
+        self.m.total_simulations_run = 0
+        received = round(self.m.compute_upper_confidence_bound(average_value=average_value, n_simul_node=n_simul_node,
+                                                               parent_passes=42), 3)
+        self.assertEqual(expected, received)
+
+    def test_upper_confidence_bounds_vectorized(self):
+        self.m.total_simulations_run = 42
+        average_values = np.array([4300., 0., 120.5, 0.])
+        n_simul_nodes = np.array([4, 0, 17, 3])
+        expected = [float(self.m.compute_upper_confidence_bound(average_value=a, n_simul_node=n)) for a, n in zip(average_values, n_simul_nodes)]
+        received = self.m.compute_upper_confidence_bounds(average_values=average_values, n_simul_nodes=n_simul_nodes)
+        np.testing.assert_allclose(received, expected)
+        self.m.total_simulations_run = 0
+        received = self.m.compute_upper_confidence_bounds(average_values=average_values, n_simul_nodes=n_simul_nodes,
+                                                          parent_passes=42)
+        np.testing.assert_allclose(received, expected)
+
+    def test_vectorized_selection_distribution(self):
+        tree = ArrayTree()
+        for city, evaluations in [("Lisbon", [9000, 8000]), ("Hamburg", [7000]), ("Madrid", [8500, 9500, 9000])]:
+            for evaluation in evaluations:
+                tree["Berlin"].update(evaluation)
+                tree["Berlin"][city].update(evaluation)
+        self.m = MonteCarloTreeSearch(self.m.game_master, tree, vectorized_selection=True, seed=42)
+        self.m.total_simulations_run = 6
+        children_ucb = {k: self.m.compute_upper_confidence_bound(average_value=tree["Berlin"][k].average_path_value,
+                                                                n_simul_node=tree["Berlin"][k].passes) for k in tree["Berlin"].keys()}
+        expected = {k: v / sum(children_ucb.values()) for k, v in children_ucb.items()}
+
+        n_draws = 4000
+        counts = {k: 0 for k in expected}
+        for i in range(n_draws):
+            counts[self.m._choose_child_vectorized(tree["Berlin"])] += 1
+        for city in expected:
+            self.assertAlmostEqual(counts[city] / n_draws, expected[city], delta=0.03)
+
+        self.m.greedy_selection = True
+        self.assertEqual(self.m._choose_child_vectorized(tree["Berlin"]), max(children_ucb, key=children_ucb.get))
+
+    def test_vectorized_selection_requires_array_tree(self):
+        with self.assertRaises(ValueError):
+            MonteCarloTreeSearch(self.m.game_master, SearchTree(), vectorized_selection=True)
+        MonteCarloTreeSearch(self.m.game_master, ArrayTree(), vectorized_selection=True)
 
     def test_select(self):
         current_path = self._mock_select()
@@ -82,8 +135,8 @@ class TestMonteCarloWithTSP(unittest.TestCase):
         self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, None)
         self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].passes, 0)
         self.m.backpropagate(evaluation)
-        self.assertEqual(self.m.search_tree["Berlin"].average_path_value, 8732.433984335672)
-        self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, 8732.433984335672)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"].average_path_value, 8723.198946256309)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, 8723.198946256309)
         self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].passes, 1)
 
     def make_one_iteration_w_mock(self):
@@ -105,17 +158,323 @@ class TestMonteCarloWithTSP(unittest.TestCase):
         self.assertListEqual(self.m.current_path, ["Berlin", "Lisbon", "Hamburg"])
         self.assertListEqual(self.m.current_game.current_game_state, ["Berlin", "Lisbon", "Hamburg"])
 
-        self.assertEqual(self.m.search_tree["Berlin"].average_path_value, 8732.433984335672)
-        self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, 8732.433984335672)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"].average_path_value, 8723.198946256309)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, 8723.198946256309)
         self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].passes, 1)
         evaluation = self._mock_simulate()
         self.m.backpropagate(evaluation)
-        self.assertEqual(self.m.search_tree["Berlin"].average_path_value, 8732.433984335672)
-        self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, 8732.433984335672)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"].average_path_value, 8723.198946256309)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"]["Lisbon"].average_path_value, 8723.198946256309)
         self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].passes, 2)
-        self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"]["Hamburg"].average_path_value, 8732.433984335672)
+        self.assertAlmostEqual(self.m.search_tree["Berlin"]["Lisbon"]["Hamburg"].average_path_value, 8723.198946256309)
         self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"]["Hamburg"].passes, 1)
 
+    def test_iterations_do_not_change_game_master(self):
+        self.m.make_iteration(5)
+        self.assertListEqual(self.m.game_master.current_game_state, ["Berlin"])
+        self.assertListEqual(self.m.game_master.possible_moves, ["Berlin", "Lisbon", "Hamburg", "Madrid", "Copenhagen"])
+        self._mock_select()
+        self.assertListEqual(self.m.current_game.current_game_state, self.m.current_path)
+
+    def test_tree_parallel_iteration(self):
+        for tree in [SearchTree(), ArrayTree()]:
+            for lock in ["tree", "node"]:
+                self.setUp()
+                self.m.search_tree = tree = type(tree)()
+                self.m.make_iteration(40, workers=4, virtual_loss=10000., lock=lock)
+                self.assertEqual(tree["Berlin"].passes, 40)
+                self.assertEqual(self.m.total_simulations_run, 40)
+                self.assertEqual(sum(child.passes for child in tree["Berlin"].values()), 40)
+                # virtual losses are reverted, only rewards of real tours are left in the averages
+                for child in tree["Berlin"].values():
+                    if child.passes:
+                        self.assertGreater(child.average_path_value, 0)
+                        self.assertLess(child.average_path_value, self.m.game_master.reward(5000))
+        with self.assertRaises(ValueError):
+            self.m.make_iteration(2, workers=2, lock="leaf")
+        self.m.instrumentation = SearchInstrumentation()
+        with self.assertRaises(ValueError):
+            self.m.make_iteration(2, workers=2)
+
+    def test_tree_parallel_selection_uses_parent_passes(self):
+        self.m.make_iteration(20)
+        self.m._locks = [threading.Lock()]
+        self.m.virtual_loss = 1.
+        # a worker's own count of simulations, the passes of the nodes also hold those of the other workers
+        self.m.total_simulations_run = 1
+        choices = []
+
+        def choose_child(branch, parent_passes=None):
+            choices.append((branch.passes, parent_passes))
+            return next(iter(branch.keys()))
+
+        with mock.patch.object(self.m, "_choose_child", side_effect=choose_child):
+            self.m._select_with_virtual_loss()
+        self.assertGreater(len(choices), 0)
+        for branch_passes, parent_passes in choices:
+            self.assertEqual(parent_passes, branch_passes)
+        self.assertGreater(choices[0][1], 20)
+
+    def test_node_locks_are_spread(self):
+        self.m._locks = [threading.Lock() for _ in range(64)]
+        tree = SearchTree()
+        nodes = [tree[i] for i in range(2000)]
+        stripes = {id(self.m._lock_for(node)) for node in nodes}
+        self.assertGreater(len(stripes), 56)
+        array_tree = ArrayTree()
+        stripes = {id(self.m._lock_for(array_tree[i])) for i in range(2000)}
+        self.assertGreater(len(stripes), 56)
+
+    def test_tree_parallel_with_transpositions(self):
+        for tree in [SearchTree(), ArrayTree()]:
+            self.setUp()
+            self.m.search_tree = tree
+            self.m.transpositions = True
+            self.m.make_iteration(200, workers=4, virtual_loss=10000., lock="node")
+            self.assertEqual(tree["Berlin"].passes, 200)
+            # every virtual loss was reverted on the shared nodes as well, a lost update would leave -10000 behind
+            nodes = [tree["Berlin"]]
+            while nodes:
+                node = nodes.pop()
+                if node.passes:
+                    self.assertGreater(node.average_path_value, 0)
+                nodes.extend(node.values())
+
+    def test_batched_leaf_evaluation(self):
+        self.m.rollouts_per_leaf = 4
+        with mock.patch.object(TravelingTourist, "evaluate_games", autospec=True,
+                               side_effect=lambda game, states: [state.evaluate_game() for state in states]) as evaluate_games:
+            self.m.make_iteration(3)
+        self.assertEqual(evaluate_games.call_count, 3)
+        self.assertEqual(self.m.total_simulations_run, 12)
+        self.assertEqual(self.m.search_tree["Berlin"].passes, 12)
+        self.assertEqual(sum(child.passes for child in self.m.search_tree["Berlin"].values()), 12)
+
+    def test_batch_rollouts(self):
+        self.m.rollouts_per_leaf = 4
+        self.m.batch_rollouts = True
+        with mock.patch.object(TravelingTourist, "evaluate_game") as evaluate_game:
+            self.m.make_iteration(3)
+        evaluate_game.assert_not_called()
+        self.assertEqual(self.m.total_simulations_run, 12)
+        self.assertEqual(self.m.search_tree["Berlin"].passes, 12)
+        self.assertEqual(sum(child.passes for child in self.m.search_tree["Berlin"].values()), 12)
+        for options in [{"rollout_policy": NearestNeighbourRollout()}, {"evaluation_cache": EvaluationCache()}]:
+            with self.assertRaises(ValueError):
+                MonteCarloTreeSearch(game_object=self.m.game_master, tree_object=SearchTree(), batch_rollouts=True,
+                                     **options)
+        game = TravelingTourist(possible_moves=["Berlin", "Lisbon", "Hamburg", "Madrid", "Copenhagen"],
+                                home_town="Berlin", current_game_state=["Berlin"], candidate_neighbours=2)
+        with self.assertRaises(ValueError):
+            MonteCarloTreeSearch(game_object=game, tree_object=SearchTree(), batch_rollouts=True)
+
+    def test_search_finds_short_tours(self):
+        cities = ["Berlin", "Paris", "Lisbon", "Madrid", "Rome", "Vienna", "Amsterdam", "Copenhagen"]
+        game = TravelingTourist(possible_moves=cities[1:] + cities[:1], home_town="Berlin",
+                                current_game_state=["Berlin"])
+        shortest = min(game.city_grid.tour_length([0] + list(tour) + [0]) for tour in permutations(range(1, 8)))
+        m = MonteCarloTreeSearch(game_object=game, tree_object=SearchTree(), seed=0)
+        m.make_iteration(3000)
+        # finish a partial best path nearest city first
+        tour = game.clone()
+        for city in m.get_best_path()[1:]:
+            tour.make_a_move(city)
+        while not tour._check_game_over():
+            tour.make_a_move(tour.order_moves(tour.generate_next_moves())[0])
+        # a random tour is about 1.7 times as long as the shortest one
+        self.assertLess(tour.evaluate_game(), 1.25 * shortest)
+
+    def test_search_limits(self):
+        result = self.m.search(max_iterations=7)
+        self.assertEqual(result.iterations, 7)
+        self.assertEqual(result.stop_reason, "max_iterations")
+        self.assertEqual(self.m.search_tree["Berlin"].passes, 7)
+        self.assertListEqual(result.best_path, self.m.get_best_path())
+
+        result = self.m.search(max_nodes=self.m.search_tree.node_count + 1, max_iterations=1000, check_interval=1)
+        self.assertEqual(result.stop_reason, "max_nodes")
+        # the tree is far from complete after 7 iterations, so the next one expands a leaf
+        self.assertEqual(result.iterations, 1)
+
+        result = self.m.search(time_limit=0.05, check_interval=1)
+        self.assertEqual(result.stop_reason, "time_limit")
+        self.assertLess(result.elapsed, 1)
+
+        with self.assertRaises(ValueError):
+            self.m.search()
+
+    def test_start(self):
+        result = self.m.start(rounds=3)
+        self.assertEqual(result.iterations, 3)
+
+    def test_commit_move(self):
+        for tree in [SearchTree(), ArrayTree()]:
+            self.setUp()
+            self.m.search_tree = tree
+            self.m.make_iteration(30)
+            passes = tree["Berlin"]["Madrid"].passes
+            node_count = tree.node_count
+            self.m.commit_move("Madrid")
+            self.assertListEqual(self.m.game_master.current_game_state, ["Berlin", "Madrid"])
+            self.assertListEqual(list(self.m.search_tree.keys()), ["Madrid"])
+            self.assertEqual(self.m.search_tree["Madrid"].passes, passes)
+            self.assertLess(self.m.search_tree.node_count, node_count)
+            self.m.make_iteration(5)
+            self.assertEqual(self.m.search_tree["Madrid"].passes, passes + 5)
+            self.assertListEqual(self.m.current_game.current_game_state[:2], ["Berlin", "Madrid"])
+            self.assertListEqual(self.m.get_best_path()[:2], ["Berlin", "Madrid"])
+
+    def test_transpositions(self):
+        for tree in [SearchTree(), ArrayTree()]:
+            self.setUp()
+            self.m.search_tree = tree
+            self.m.transpositions = True
+            self.m.rng = RandomStream(42)
+            self.m.make_iteration(200)
+            self.assertEqual(tree["Berlin"].passes, 200)
+            # one node per distinct game state below the root
+            self.assertEqual(tree.node_count, len(self.m.transposition_table) + 1)
+            # Berlin - Lisbon - Hamburg - Madrid and Berlin - Hamburg - Lisbon - Madrid end in the same state
+            first = tree["Berlin"].get("Lisbon").get("Hamburg").get("Madrid")
+            second = tree["Berlin"].get("Hamburg").get("Lisbon").get("Madrid")
+            self.assertEqual(first.node_id, second.node_id)
+
+    def test_memory_bounded_tree(self):
+        for tree in [SearchTree(max_nodes=20), ArrayTree(max_nodes=20, eviction_policy="visits")]:
+            self.setUp()
+            self.m.search_tree = tree
+            self.m.make_iteration(100)
+            self.assertLessEqual(tree.node_count, 20)
+            self.assertGreater(tree.evictions, 0)
+            self.assertGreater(tree.evicted_nodes, 0)
+            # evicted nodes were folded into their parents, the root keeps every simulation
+            self.assertEqual(tree["Berlin"].passes, 100)
+            self.assertEqual(len(self.m.get_best_path()), len(set(self.m.get_best_path())))
+
+    def test_resume_from_saved_tree(self):
+        self.m.make_iteration(20)
+        with tempfile.TemporaryDirectory() as directory:
+            self.m.search_tree.save(directory)
+            for tree in [SearchTree.load(directory), ArrayTree.load(directory)]:
+                self.setUp()
+                self.m.search_tree = tree
+                self.assertEqual(tree["Berlin"].passes, 20)
+                self.m.make_iteration(5)
+                self.assertEqual(tree["Berlin"].passes, 25)
+
+    def test_checkpoint_to_the_loaded_path(self):
+        # a complete tree, so that the loaded columns are updated in place and never copied into memory
+        self.m.make_iteration(600)
+        with tempfile.TemporaryDirectory() as directory:
+            self.m.search_tree.save(directory)
+            for tree_class in [ArrayTree, SearchTree]:
+                self.setUp()
+                self.m.search_tree = tree_class.load(directory)
+                passes = self.m.search_tree["Berlin"].passes
+                self.m.make_iteration(5)
+                # the columns of the ArrayTree are still mapped from the files that are overwritten
+                self.m.search_tree.save(directory)
+                self.assertEqual(tree_class.load(directory)["Berlin"].passes, passes + 5)
+                self.assertEqual(ArrayTree.load(directory).node_count, self.m.search_tree.node_count)
+
+    def test_progressive_widening(self):
+        for tree in [SearchTree(), ArrayTree()]:
+            self.setUp()
+            self.m.search_tree = tree
+            self.m.progressive_widening = True
+            self.m.make_iteration(16)
+            # the root got one child per iteration until sqrt(passes) was reached, nearest city first
+            self.assertEqual(tree["Berlin"].passes, 16)
+            self.assertLessEqual(len(tree["Berlin"]), 4)
+            self.assertEqual(list(tree["Berlin"].keys())[0], "Hamburg")
+            for child in tree["Berlin"].values():
+                self.assertLessEqual(len(child), max(1, int(child.passes ** 0.5)))
+
+    def test_progressive_widening_cursors(self):
+        self.m.progressive_widening = True
+        with mock.patch.object(self.m.current_game, "widening_order",
+                               wraps=self.m.current_game.widening_order) as widening_order:
+            self.m.make_iteration(50)
+        # one cursor per node, created once
+        self.assertEqual(widening_order.call_count, len(self.m.widening_cursors))
+        root = self.m.search_tree["Berlin"]
+        self.assertEqual(list(root.keys())[0], "Hamburg")
+        self.assertIn(root.node_id, self.m.widening_cursors)
+        self.m.commit_move("Hamburg")
+        self.assertDictEqual(self.m.widening_cursors, {})
+
+    def test_widening_cursor_is_lazy(self):
+        moves = iter(range(1000))
+        cursor = WideningCursor(moves)
+        node = {}
+        self.assertListEqual(cursor.untried(node, 2), [0, 1])
+        node[0] = None
+        self.assertListEqual(cursor.untried(node, 2), [1, 2])
+        node[3] = None
+        self.assertListEqual(cursor.untried(node, 3), [1, 2, 4])
+        # only the moves needed so far were taken
+        self.assertEqual(next(moves), 5)
+        self.assertListEqual(WideningCursor(iter([])).untried(node, 1), [])
+
+    def test_seeded_searches_are_reproducible(self):
+        paths = []
+        for _ in range(2):
+            self.setUp()
+            self.m.rng = RandomStream(7)
+            self.m.make_iteration(30)
+            paths.append([(move, child.passes) for move, child in self.m.search_tree["Berlin"].items()])
+        self.assertListEqual(paths[0], paths[1])
+
+    def _run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_search_async(self):
+        result = self._run_async(self.m.search_async(max_iterations=50, slice_size=8))
+        self.assertEqual(result.iterations, 50)
+        self.assertEqual(result.stop_reason, "max_iterations")
+        self.assertEqual(self.m.search_tree["Berlin"].passes, 50)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = self._run_async(self.m.search_async(time_limit=0.2, executor=executor))
+        self.assertEqual(result.stop_reason, "time_limit")
+        self.assertEqual(self.m.search_tree["Berlin"].passes, 50 + result.iterations)
+
+    def test_stream_best_paths(self):
+        async def collect():
+            return [result async for result in self.m.stream_best_paths(max_iterations=64, slice_size=4)]
+        results = self._run_async(collect())
+        self.assertEqual(results[-1].stop_reason, "max_iterations")
+        self.assertEqual(results[-1].iterations, 64)
+        self.assertTrue(all(result.stop_reason is None for result in results[:-1]))
+        iterations = [result.iterations for result in results]
+        self.assertListEqual(iterations, sorted(iterations))
+
+    def test_search_async_cancellation(self):
+        async def cancelled_search(executor):
+            with self.assertRaises(asyncio.TimeoutError):
+                # a slice this long only ends because it is cancelled
+                await asyncio.wait_for(self.m.search_async(time_limit=60, slice_size=10 ** 9, executor=executor),
+                                       timeout=0.2)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self._run_async(cancelled_search(executor))
+            # the cancellation waited for the slice, the executor is idle
+            passes = self.m.search_tree["Berlin"].passes
+            self.assertGreater(passes, 0)
+            executor.submit(lambda: None).result(timeout=10)
+            self.assertEqual(self.m.search_tree["Berlin"].passes, passes)
+
+    def test_array_tree_iteration(self):
+        self.m.search_tree = ArrayTree()
+        self.make_one_iteration_w_mock()
+        current_path = self._mock_select()
+        self.assertListEqual(current_path, ["Berlin", "Lisbon"])
+        self.assertListEqual(self.m.search_tree["Berlin"].keys(), ["Lisbon", "Hamburg", "Madrid", "Copenhagen"])
+        self.assertEqual(self.m.search_tree["Berlin"]["Lisbon"].passes, 1)
+        self.assertListEqual(self.m.get_best_path(), ["Berlin", "Lisbon"])
+
     def tearDown(self):
         pass
 
@@ -134,12 +493,12 @@ class TestMonteCarloWithNLG(unittest.TestCase):
         return current_path
 
     def _mock_expand(self):
-        with mock.patch('random.choice', patched_random_choice):
+        with mock.patch.object(RandomStream, 'choice', patched_random_choice):
             expanded_path = self.m.expand()
         return expanded_path
 
     def _mock_simulate(self):
-        with mock.patch('random.choice', patched_random_choice):
+        with mock.patch.object(RandomStream, 'choice', patched_random_choice):
             evaluation = self.m.simulate()
         return evaluation
 
@@ -1,6 +1,7 @@
 import unittest
+import unittest.mock as mock
 
-from game import MoveNotAllowedError, GameInitiationError
+from game import MoveNotAllowedError, GameInitiationError, GameStateError
 from nlg import NLGame
 from sentence_classifier.sentence_classifier import SentenceClassifier
 from traveling_tourist import TravelingTourist
@@ -77,6 +78,49 @@ class TestNLG(unittest.TestCase):
                 self.assertTrue(self.t._check_move_possible(allowed))
             self.tearDown()
 
+    def test_undo_move_and_clone(self):
+        sentence_classifier = object()
+        self.t = NLGame(vocabulary=["my", "name", "is", "john"],
+                        starting_word="my",
+                        current_game_state=["my"],
+                        sentence_classifier=sentence_classifier)
+        clone = self.t.clone()
+        clone.make_a_move("name")
+        clone.make_a_move("is")
+        self.assertListEqual(self.t.current_game_state, ["my"])
+        self.assertIs(clone.sentence_classifier, sentence_classifier)
+        clone.undo_move()
+        self.assertListEqual(clone.current_game_state, ["my", "name"])
+        clone.undo_move()
+        with self.assertRaises(GameStateError):
+            clone.undo_move()
+
+
+    def test_evaluate_games(self):
+        sentence_classifier = mock.Mock()
+        sentence_classifier.sentences_are_human.return_value = [True, False]
+        self.t = NLGame(vocabulary=["my", "name", "is", "john"],
+                        starting_word="my",
+                        current_game_state=["my", "name", "is"],
+                        sentence_classifier=sentence_classifier)
+        other = self.t.clone()
+        other.make_a_move("john")
+        self.assertListEqual(self.t.evaluate_games([self.t, other]), [1, 0])
+        sentence_classifier.sentences_are_human.assert_called_once_with([["my", "name", "is"], ["my", "name", "is", "john"]])
+
+    def test_widening_order(self):
+        sentence_classifier = mock.Mock()
+        sentence_classifier.known_bigrams = {("my", "john"), ("my", "name"), ("name", "is"), ("is", "unknown")}
+        self.t = NLGame(vocabulary=["my", "name", "is", "john"],
+                        starting_word="my",
+                        current_game_state=["my"],
+                        sentence_classifier=sentence_classifier)
+        for state in [["my"], ["my", "name"], ["my", "name", "is"], ["my", "name", "is", "john"]]:
+            self.t.current_game_state = state
+            self.assertListEqual(list(self.t.widening_order()), self.t.order_moves(self.t.generate_next_moves()))
+        self.assertListEqual(list(self.t.clone().widening_order()), ["my", "name", "is", "john"])
+
+
 class TestSentenceClassifier(unittest.TestCase):
     def setUp(self):
         self.sentence_classifier =SentenceClassifier()
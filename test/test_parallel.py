@@ -0,0 +1,66 @@
+import unittest
+
+import parallel
+from parallel import RootParallelSearch, collect_statistics, merge_statistics
+from traveling_tourist import TravelingTourist
+from tree import ArrayTree, SearchTree
+
+
+class TestRootParallelSearch(unittest.TestCase):
+    def setUp(self):
+        self.traveling_tourist = TravelingTourist(possible_moves=["Berlin", "Lisbon", "Hamburg", "Madrid", "Copenhagen"],
+                                                  home_town="Berlin",
+                                                  current_game_state=["Berlin"])
+
+    def test_collect_and_merge_statistics(self):
+        tree = SearchTree()
+        for value in [3, 5]:
+            tree["Berlin"].update(value)
+            tree["Berlin"]["Lisbon"].update(value)
+            tree["Berlin"]["Lisbon"]["Madrid"].update(value)
+        tree["Berlin"]["Hamburg"]
+        statistics = collect_statistics(tree, depth=1)
+        self.assertDictEqual(statistics, {("Berlin",): (2, 8, 34), ("Berlin", "Lisbon"): (2, 8, 34)})
+
+        merged = ArrayTree()
+        merge_statistics(merged, statistics)
+        merge_statistics(merged, statistics)
+        self.assertEqual(merged["Berlin"]["Lisbon"].passes, 4)
+        self.assertEqual(merged["Berlin"]["Lisbon"].average_path_value, 4)
+        self.assertNotIn("Hamburg", merged["Berlin"])
+
+    def test_make_iteration(self):
+        with RootParallelSearch(game_object=self.traveling_tourist, n_workers=2, seed=42) as search:
+            report = search.make_iteration(10)
+            self.assertEqual(report["iterations"], 20)
+            self.assertEqual(len(report["worker_iterations_per_second"]), 2)
+            self.assertEqual(search.search_tree["Berlin"].passes, 20)
+            self.assertEqual(sum(child.passes for child in search.search_tree["Berlin"].values()), 20)
+            executors = search._executors
+            # the workers keep their processes and trees, only what was added is merged again
+            search.make_iteration(5)
+            self.assertIs(search._executors, executors)
+            self.assertEqual(search.search_tree["Berlin"].passes, 30)
+            self.assertEqual(sum(child.passes for child in search.search_tree["Berlin"].values()), 30)
+            best_path = search.get_best_path()
+        self.assertListEqual(search._executors, [])
+        self.assertEqual(best_path[0], "Berlin")
+        self.assertEqual(len(best_path), 2)
+        self.assertListEqual(self.traveling_tourist.current_game_state, ["Berlin"])
+
+    def test_worker_reports_added_statistics(self):
+        parallel._start_worker(self.traveling_tourist, SearchTree, 0, {})
+        first, simulations_run, _ = parallel._continue_search(10, 1)
+        self.assertEqual(first[("Berlin",)][0], 10)
+        self.assertEqual(simulations_run, 10)
+        second, simulations_run, _ = parallel._continue_search(5, 1)
+        self.assertEqual(second[("Berlin",)][0], 5)
+        self.assertEqual(simulations_run, 5)
+        self.assertEqual(parallel._worker_search.search_tree["Berlin"].passes, 15)
+        merged = SearchTree()
+        merge_statistics(merged, first)
+        merge_statistics(merged, second)
+        self.assertAlmostEqual(merged["Berlin"].value_sum, parallel._worker_search.search_tree["Berlin"].value_sum)
+
+    def tearDown(self):
+        pass
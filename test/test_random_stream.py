@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from random_stream import RandomStream
+
+
+class TestRandomStream(unittest.TestCase):
+    def setUp(self):
+        self.rng = RandomStream(42, block_size=16)
+
+    def test_reproducible(self):
+        other = RandomStream(42, block_size=16)
+        # draws continue across block refills
+        draws = [self.rng.random() for _ in range(40)]
+        self.assertListEqual(draws, [other.random() for _ in range(40)])
+        self.assertTrue(all(0 <= draw < 1 for draw in draws))
+        self.assertNotEqual(draws, [RandomStream(43).random() for _ in range(40)])
+
+    def test_spawn(self):
+        first, second = self.rng.spawn(2)
+        self.assertNotEqual([first.random() for _ in range(5)], [second.random() for _ in range(5)])
+        again = RandomStream(42, block_size=16).spawn(1)[0]
+        self.assertEqual(RandomStream(42, block_size=16).spawn(2)[0].random(), again.random())
+
+    def test_choice(self):
+        draws = [self.rng.integer(3) for _ in range(3000)]
+        self.assertSetEqual(set(draws), {0, 1, 2})
+        self.assertIn(self.rng.choice(["a", "b"]), ["a", "b"])
+
+    def test_weighted_choice(self):
+        weights = np.array([1., 0., 3.])
+        counts = np.bincount([self.rng.weighted_index(weights) for _ in range(4000)], minlength=3)
+        np.testing.assert_allclose(counts / 4000, [0.25, 0., 0.75], atol=0.03)
+        self.assertEqual(self.rng.weighted_choice(["a", "b"], [0., 2.]), "b")
+
+    def tearDown(self):
+        self.rng = None
@@ -0,0 +1,58 @@
+import unittest
+import unittest.mock as mock
+from collections import Counter
+
+from monte_carlo import MonteCarloTreeSearch
+from nlg import NLGame
+from random_stream import RandomStream
+from rollout import BigramRollout, NearestNeighbourRollout, UniformRollout
+from traveling_tourist import TravelingTourist
+from tree import SearchTree
+
+
+class TestRolloutPolicies(unittest.TestCase):
+    def setUp(self):
+        self.rng = RandomStream(42)
+        self.traveling_tourist = TravelingTourist(possible_moves=["Lisbon", "Madrid", "Hamburg", "Copenhagen", "Berlin"],
+                                                  home_town="Berlin",
+                                                  current_game_state=["Berlin"])
+
+    def test_uniform(self):
+        moves = self.traveling_tourist.generate_next_moves()
+        counts = Counter(UniformRollout().choose_move(self.traveling_tourist, moves, self.rng) for _ in range(400))
+        self.assertSetEqual(set(counts), set(moves))
+
+    def test_nearest_neighbour(self):
+        policy = NearestNeighbourRollout(epsilon=0.)
+        tour = []
+        game = self.traveling_tourist.clone()
+        while not game._check_game_over():
+            move = policy.choose_move(game, game.generate_next_moves(), self.rng)
+            game.make_a_move(move)
+            tour.append(move)
+        self.assertListEqual(tour, ["Hamburg", "Copenhagen", "Madrid", "Lisbon", "Berlin"])
+
+    def test_bigram(self):
+        sentence_classifier = mock.Mock()
+        sentence_classifier.known_bigrams = {("my", "name"), ("name", "is")}
+        game = NLGame(vocabulary=["my", "name", "is", "john"], current_game_state=["my"], starting_word="my",
+                      sentence_classifier=sentence_classifier)
+        policy = BigramRollout(successor_weight=100.)
+        counts = Counter(policy.choose_move(game, ["name", "is", "john"], self.rng) for _ in range(200))
+        self.assertGreater(counts["name"], 150)
+        # without a known successor every word is equally likely
+        game.make_a_move("john")
+        counts = Counter(policy.choose_move(game, ["name", "is", "john"], self.rng) for _ in range(300))
+        self.assertSetEqual(set(counts), {"name", "is", "john"})
+
+    def test_search_uses_policy(self):
+        policy = NearestNeighbourRollout(epsilon=0.)
+        search = MonteCarloTreeSearch(game_object=self.traveling_tourist, tree_object=SearchTree(),
+                                      rollout_policy=policy)
+        with mock.patch.object(policy, "choose_move", wraps=policy.choose_move) as choose_move:
+            search.make_iteration(3)
+        self.assertGreater(choose_move.call_count, 0)
+        self.assertEqual(search.search_tree["Berlin"].passes, 3)
+
+    def tearDown(self):
+        self.traveling_tourist = None
@@ -0,0 +1,184 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from tree import ArrayTree, SearchTree
+
+
+class TestArrayTree(unittest.TestCase):
+    def setUp(self):
+        self.tree = ArrayTree(capacity=2)
+
+    def test_item_access_creates_nodes(self):
+        self.tree["Berlin"]["Paris"]
+        self.tree["Berlin"]["Lisbon"]
+        self.assertEqual(self.tree.node_count, 3)
+        self.assertListEqual(self.tree["Berlin"].keys(), ["Paris", "Lisbon"])
+        self.assertListEqual(self.tree["Berlin"]["Lisbon"].full_path, ["Berlin", "Lisbon"])
+        # growing beyond the initial capacity keeps all rows
+        self.assertGreaterEqual(self.tree.store.capacity, 4)
+
+    def test_get_does_not_create_nodes(self):
+        self.tree["Berlin"]
+        self.assertIsNone(self.tree["Berlin"].get("Paris"))
+        self.assertNotIn("Paris", self.tree["Berlin"])
+        self.assertEqual(self.tree.node_count, 1)
+
+    def test_statistics_match_search_tree(self):
+        search_tree = SearchTree()
+        for tree in [self.tree, search_tree]:
+            node = tree["my"]["name"]
+            for value in [1, 0, 0]:
+                node.update(value)
+        self.assertEqual(self.tree["my"]["name"].passes, search_tree["my"]["name"].passes)
+        self.assertAlmostEqual(self.tree["my"]["name"].average_path_value, search_tree["my"]["name"].average_path_value)
+        self.assertIsNone(self.tree["my"].average_path_value)
+
+    def test_variance(self):
+        search_tree = SearchTree()
+        variance_tree = ArrayTree(track_variance=True)
+        for tree in [search_tree, variance_tree]:
+            for value in [2, 4, 4, 4, 5, 5, 7, 9]:
+                tree["a"].update(value)
+            self.assertEqual(tree["a"].value_sum, 40)
+            self.assertEqual(tree["a"].average_path_value, 5)
+            self.assertAlmostEqual(tree["a"].variance, 4)
+        self.tree["a"].update(1)
+        self.assertIsNone(self.tree["a"].variance)
+
+    def test_fragmented_children(self):
+        self.tree["a"]["b"]
+        self.tree["a"]["c"]["x"]
+        self.tree["a"]["d"]
+        self.assertListEqual(self.tree["a"].keys(), ["b", "c", "d"])
+        self.assertEqual(self.tree["a"]["d"].full_path, ["a", "d"])
+        self.assertListEqual(self.tree["a"]["c"].keys(), ["x"])
+
+    def test_node_count_matches_search_tree(self):
+        search_tree = SearchTree()
+        for tree in [self.tree, search_tree]:
+            tree["a"]["b"]
+            tree["a"]["c"]["x"]
+            tree["a"].get("d")
+        self.assertEqual(search_tree.node_count, 4)
+        self.assertEqual(search_tree["a"]["c"].node_count, 4)
+        self.assertEqual(self.tree.node_count, 4)
+
+    def test_reroot(self):
+        search_tree = SearchTree()
+        for tree in [self.tree, search_tree]:
+            tree["a"]["b"]["x"].update(1)
+            tree["a"]["c"]["y"].update(2)
+            tree["a"]["c"]["z"]["w"].update(3)
+            tree["a"]["b"]["v"]
+            tree["a"]["c"].update(5)
+            tree.reroot("a", "c")
+            self.assertListEqual(list(tree.keys()), ["c"])
+            self.assertListEqual(list(tree["c"].keys()), ["y", "z"])
+            self.assertEqual(tree["c"].passes, 1)
+            self.assertEqual(tree["c"]["z"]["w"].average_path_value, 3)
+            self.assertEqual(tree.node_count, 4)
+        self.assertListEqual(self.tree["c"]["z"]["w"].full_path, ["c", "z", "w"])
+        # the compacted store keeps working as before
+        self.tree["c"]["q"]
+        self.assertListEqual(self.tree["c"].keys(), ["y", "z", "q"])
+
+    def test_link_shares_node(self):
+        search_tree = SearchTree()
+        for tree in [self.tree, search_tree]:
+            shared = tree["a"]["b"]["c"]
+            tree["a"]["x"].link("c", shared)
+            tree["a"]["x"]["c"].update(4)
+            tree["a"]["x"]["c"]["d"]
+            self.assertEqual(tree["a"]["b"]["c"].passes, 1)
+            self.assertListEqual(list(tree["a"]["b"]["c"].keys()), ["d"])
+            self.assertEqual(tree.node_count, 5)
+            passes, averages = tree["a"]["x"].child_statistics()
+            self.assertListEqual(list(averages), [4])
+            # the linked node survives when only the linking parent is kept
+            tree.reroot("a", "x")
+            self.assertEqual(tree["x"]["c"].passes, 1)
+            self.assertListEqual(list(tree["x"]["c"].keys()), ["d"])
+            self.assertEqual(tree.node_count, 3)
+
+    def test_evict(self):
+        for tree in [SearchTree(max_nodes=6), ArrayTree(max_nodes=6)]:
+            for move in ["b", "c"]:
+                tree.tick()
+                tree["a"][move]["x"].update(1)
+                tree["a"][move]["y"].update(1)
+                tree["a"][move].update(1)
+            tree.tick()
+            tree["a"].update(3)
+            self.assertTrue(tree.over_budget)
+            self.assertEqual(tree.evict(), 2)
+            # the least recently visited family is dropped, its parent is a leaf again
+            self.assertListEqual(list(tree["a"].get("b").keys()), [])
+            self.assertListEqual(list(tree["a"].get("c").keys()), ["x", "y"])
+            self.assertEqual(tree["a"]["b"].passes, 1)
+            self.assertEqual(tree.node_count, 5)
+            self.assertEqual(tree.evicted_nodes, 2)
+            self.assertFalse(tree.over_budget)
+
+    def test_save_and_load(self):
+        search_tree = SearchTree()
+        for tree in [self.tree, search_tree]:
+            tree["a"]["b"]["x"].update(1)
+            tree["a"]["c"].update(2)
+            tree["a"]["c"].link("x", tree["a"]["b"]["x"])
+            tree["a"].update(3)
+        with tempfile.TemporaryDirectory() as directory:
+            for i, tree in enumerate([self.tree, search_tree]):
+                path = os.path.join(directory, str(i))
+                tree.save(path)
+                for loaded in [SearchTree.load(path), ArrayTree.load(path)]:
+                    self.assertEqual(loaded.node_count, 4)
+                    self.assertListEqual(list(loaded["a"].keys()), ["b", "c"])
+                    self.assertEqual(loaded["a"].average_path_value, 3)
+                    self.assertEqual(loaded["a"]["c"]["x"].node_id, loaded["a"]["b"]["x"].node_id)
+                    self.assertEqual(loaded["a"]["c"]["x"].passes, 1)
+                    # loaded trees keep growing, the files stay untouched
+                    loaded["a"]["c"]["y"].update(4)
+                    self.assertEqual(loaded.node_count, 5)
+                self.assertIsInstance(ArrayTree.load(path).store.passes, np.memmap)
+                self.assertEqual(ArrayTree.load(path).node_count, 4)
+
+    def test_add_children(self):
+        search_tree = SearchTree()
+        for tree in [self.tree, search_tree]:
+            tree["a"]["b"].update(1)
+            tree["a"].add_children(["b", "c", "d"])
+            self.assertListEqual(list(tree["a"].keys()), ["b", "c", "d"])
+            self.assertEqual(tree["a"]["b"].passes, 1)
+        self.assertEqual(self.tree.node_count, 4)
+
+    def test_memory_per_node(self):
+        def traced_bytes(tree_class):
+            tracemalloc.start()
+            tree = tree_class()
+            root = tree["root"]
+            root.add_children(range(100))
+            for child in root.values():
+                child.add_children(range(200))
+                child.update(1)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertEqual(tree.node_count, 20101)
+            return peak
+        self.assertGreater(traced_bytes(SearchTree), 10 * traced_bytes(ArrayTree))
+
+    def test_grow_in_place(self):
+        self.tree["a"]["b"].update(2)
+        for move in range(20):
+            self.tree["a"]["c"][move]
+        self.assertEqual(self.tree.node_count, 23)
+        self.assertEqual(self.tree["a"]["b"].average_path_value, 2)
+        self.assertEqual(len(self.tree["a"]["c"]), 20)
+        # rows beyond the used ones are empty
+        self.assertTrue((self.tree.store.parent[self.tree.store.size:] == -1).all())
+
+    def tearDown(self):
+        self.tree = None
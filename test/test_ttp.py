@@ -1,8 +1,16 @@
+import os
+import shutil
+import tempfile
 import unittest
+import unittest.mock as mock
 
-from game import MoveNotAllowedError, GameInitiationError
-from traveling_tourist import TravelingTourist
+import numpy as np
+import pandas as pd
+
+from game import MoveNotAllowedError, GameInitiationError, GameStateError
+from traveling_tourist import CityGrid, CityIndex, TravelingTourist
 from helper_functions import _assert_almost_equel
+from random_stream import RandomStream
 
 class TestTravelingTourist(unittest.TestCase):
     def setUp(self):
@@ -200,6 +208,157 @@ class TestTravelingTourist(unittest.TestCase):
             #
             self.tearDown()
 
+    def test_undo_move(self):
+        self.t = TravelingTourist(possible_moves=["Berlin", "Paris", "Lisbon", "Madrid"],
+                                  home_town="Berlin",
+                                  current_game_state=["Berlin"])
+        self.t.make_a_move("Lisbon")
+        self.t.make_a_move("Paris")
+        self.assertListEqual(self.t.possible_moves, ["Berlin", "Madrid"])
+        self.t.undo_move()
+        self.t.undo_move()
+        self.assertListEqual(self.t.current_game_state, ["Berlin"])
+        self.assertListEqual(self.t.possible_moves, ["Berlin", "Paris", "Lisbon", "Madrid"])
+        with self.assertRaises(GameStateError):
+            self.t.undo_move()
+
+    def test_tour_length_is_incremental(self):
+        rng = np.random.RandomState(7)
+        cities = ["Berlin", "Paris", "Lisbon", "Madrid", "Athens", "London", "Oslo"]
+        self.t = TravelingTourist(possible_moves=cities, home_town="Berlin", current_game_state=["Berlin", "Rome"])
+        for _ in range(200):
+            moves = self.t.generate_next_moves()
+            if moves and (self.t._n_moves_made == 0 or rng.rand() < 0.7):
+                self.t.make_a_move(moves[rng.randint(len(moves))])
+            else:
+                self.t.undo_move()
+            full_length = sum(self.t.city_grid.distance_between_two_cities(city1, city2) for city1, city2
+                              in zip(self.t.current_game_state[:-1], self.t.current_game_state[1:]))
+            self.assertAlmostEqual(self.t.tour_length, full_length)
+            if self.t._check_game_over():
+                self.assertAlmostEqual(self.t.evaluate_game(), full_length)
+                self.assertAlmostEqual(self.t.clone().tour_length, full_length)
+
+    def test_candidate_neighbours(self):
+        cities = ["Berlin", "Paris", "Lisbon", "Madrid", "Athens", "London", "Oslo", "Rome", "Vienna", "Amsterdam",
+                  "Copenhagen", "Dublin", "Budapest", "Hamburg", "Prague"]
+        grid = CityGrid(cities)
+        nearest = grid.nearest_neighbours(3)
+        self.assertEqual(nearest.shape, (15, 3))
+        np.testing.assert_array_equal(nearest, np.argsort(grid.distance_matrix, axis=1)[:, 1:4])
+
+        self.t = TravelingTourist(possible_moves=cities, home_town="Berlin", current_game_state=["Berlin"],
+                                  candidate_neighbours=3)
+        candidates = [cities[index] for index in nearest[0]]
+        self.assertSetEqual(set(self.t.generate_next_moves()), set(candidates))
+        # moves outside the candidates stay legal
+        self.assertTrue(self.t._check_move_possible("Lisbon"))
+        self.assertNotIn("Lisbon", candidates)
+
+        # once all candidates of the current city are visited, every legal city is offered
+        others = [city for city in cities if city not in candidates + ["Berlin", "Lisbon"]]
+        self.t = TravelingTourist(possible_moves=others + ["Lisbon"], home_town="Lisbon",
+                                  current_game_state=["Lisbon"] + candidates + ["Berlin"], candidate_neighbours=3)
+        self.assertListEqual(self.t.generate_next_moves(), others)
+        with self.assertRaises(GameInitiationError):
+            TravelingTourist(possible_moves=cities, home_town="Berlin", current_game_state=["Berlin"],
+                             candidate_neighbours=0)
+
+    def test_reward(self):
+        self.t = TravelingTourist(possible_moves=["Paris", "Lisbon", "Madrid", "Berlin"], home_town="Berlin",
+                                  current_game_state=["Berlin"])
+        lengths = self.t.rollout_batch(100, RandomStream(1))
+        rewards = [self.t.reward(length) for length in lengths]
+        # the search maximizes rewards, so the shortest tour has to get the highest one
+        self.assertEqual(int(np.argmax(rewards)), int(np.argmin(lengths)))
+        self.assertGreater(min(rewards), 0)
+
+    def test_rollout_batch(self):
+        cities = ["Berlin", "Paris", "Lisbon", "Madrid", "Athens", "London"]
+        self.t = TravelingTourist(possible_moves=cities, home_town="Berlin", current_game_state=["Berlin"])
+        self.t.make_a_move("Paris")
+        lengths, best_tour = self.t.rollout_batch(64, RandomStream(3), return_best=True)
+        self.assertEqual(lengths.shape, (64,))
+        self.assertListEqual(best_tour[:2], ["Berlin", "Paris"])
+        self.assertEqual(best_tour[-1], "Berlin")
+        self.assertSetEqual(set(best_tour), set(cities))
+        game = self.t.clone()
+        for city in best_tour[2:]:
+            game.make_a_move(city)
+        self.assertAlmostEqual(lengths.min(), game.evaluate_game())
+        self.assertTrue((lengths >= self.t.tour_length).all())
+        np.testing.assert_array_equal(lengths, self.t.rollout_batch(64, RandomStream(3)))
+        # a finished tour has a single completion
+        np.testing.assert_allclose(game.rollout_batch(3, RandomStream(3)), game.evaluate_game())
+
+    def test_clone(self):
+        self.t = TravelingTourist(possible_moves=["Berlin", "Paris", "Lisbon"],
+                                  home_town="Berlin",
+                                  current_game_state=["Berlin"])
+        clone = self.t.clone()
+        clone.make_a_move("Paris")
+        self.assertListEqual(self.t.current_game_state, ["Berlin"])
+        self.assertListEqual(self.t.possible_moves, ["Berlin", "Paris", "Lisbon"])
+        self.assertIs(clone.city_grid, self.t.city_grid)
+        clone.undo_move()
+        self.assertListEqual(clone.possible_moves, self.t.possible_moves)
+
+    def test_move_order_is_kept(self):
+        possible_moves = ["Madrid", "Berlin", "Lisbon", "Paris"]
+        self.t = TravelingTourist(possible_moves=possible_moves, home_town="Berlin", current_game_state=["Berlin"])
+        self.assertListEqual(self.t.generate_next_moves(), ["Madrid", "Lisbon", "Paris"])
+        self.t.make_a_move("Lisbon")
+        self.assertListEqual(self.t.possible_moves, ["Madrid", "Berlin", "Paris"])
+        self.assertFalse(self.t._check_move_possible("Lisbon"))
+        self.assertFalse(self.t._check_move_possible("Berlin"))
+        self.t.undo_move()
+        self.assertListEqual(self.t.possible_moves, possible_moves)
+        self.assertTrue(self.t._check_move_possible("Lisbon"))
+        # the lists given to the game are not modified
+        self.t.make_a_move("Paris")
+        self.assertListEqual(possible_moves, ["Madrid", "Berlin", "Lisbon", "Paris"])
+        with self.assertRaises(GameInitiationError):
+            TravelingTourist(possible_moves=["Paris", "Paris"], home_town="Berlin", current_game_state=["Berlin"])
+
+    def test_state_key(self):
+        tours = []
+        for first, second in [("Paris", "Lisbon"), ("Lisbon", "Paris")]:
+            t = TravelingTourist(possible_moves=["Berlin", "Paris", "Lisbon", "Madrid"],
+                                 home_town="Berlin",
+                                 current_game_state=["Berlin"])
+            t.make_a_move(first)
+            t.make_a_move(second)
+            tours.append(t)
+        # same cities visited, but standing in a different city
+        self.assertNotEqual(tours[0].state_key(), tours[1].state_key())
+        for t in tours:
+            t.make_a_move("Madrid")
+        self.assertEqual(tours[0].state_key(), tours[1].state_key())
+        tours[1].undo_move()
+        self.assertNotEqual(tours[0].state_key(), tours[1].state_key())
+
+    def test_order_moves(self):
+        self.t = TravelingTourist(possible_moves=["Lisbon", "Madrid", "Hamburg", "Copenhagen"],
+                                  home_town="Berlin",
+                                  current_game_state=["Berlin"])
+        self.assertListEqual(self.t.order_moves(self.t.generate_next_moves()),
+                             ["Hamburg", "Copenhagen", "Madrid", "Lisbon"])
+
+    def test_widening_order(self):
+        cities = ["Berlin", "Paris", "Lisbon", "Madrid", "Athens", "London", "Oslo", "Rome", "Vienna", "Amsterdam"]
+        for candidate_neighbours in [None, 3]:
+            self.t = TravelingTourist(possible_moves=cities, home_town="Berlin", current_game_state=["Berlin"],
+                                      candidate_neighbours=candidate_neighbours)
+            for move in ["Paris", "Rome", "London"]:
+                order = self.t.widening_order()
+                self.assertListEqual(list(order), self.t.order_moves(self.t.generate_next_moves()))
+                self.t.make_a_move(move)
+            # the order of a state does not change with later moves
+            order = self.t.widening_order()
+            expected = self.t.order_moves(self.t.generate_next_moves())
+            self.t.make_a_move(expected[0])
+            self.assertListEqual(list(order), expected)
+
     def test_cities_exist(self):
         cities_to_test = ['Barcelona', 'Belgrade', 'Berlin', 'Brussels', 'Bucharest', 'Budapest', 'Copenhagen', 'Dublin', 'Paris', 'Lisbon', 'Madrid', 'Cologne', 'Bern', 'Amsterdam', 'London', 'Manchester', 'Oslo', 'Rome', 'Sicily', 'Montpellier', 'Zurich', 'Vienna', 'Athens']
         self.t = TravelingTourist(
@@ -230,6 +389,51 @@ class TestTravelingTourist(unittest.TestCase):
             distance_computed = int(self.t.city_grid.distance_between_two_cities(*distance_dict["cities"]))
             _assert_almost_equel(distance_computed, distance_dict["distance_expected"], factor=0.05)
 
+    def test_distance_matrix(self):
+        cities_to_test = ['Berlin', 'Paris', 'Lisbon', 'Athens', 'London', 'Oslo']
+        haversine = CityGrid(cities_to_test).distance_matrix
+        geodesic = CityGrid(cities_to_test, distance_method="geodesic").distance_matrix
+        self.assertEqual(haversine.shape, (6, 6))
+        np.testing.assert_allclose(haversine, haversine.T)
+        np.testing.assert_allclose(np.diag(haversine), 0.)
+        # the sphere is off by less than half a percent from the ellipsoid
+        np.testing.assert_allclose(haversine, geodesic, rtol=0.005)
+        with self.assertRaises(ValueError):
+            CityGrid(cities_to_test, distance_method="manhattan")
+
+    def test_city_index(self):
+        directory = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(directory, "cities.csv")
+            shutil.copy(CityIndex.csv_path, csv_path)
+            with mock.patch.object(pd, "read_csv", wraps=pd.read_csv) as read_csv:
+                index = CityIndex.load(csv_path, sidecar=True)
+                cached = CityIndex.load(csv_path, sidecar=True)
+            # the second load maps the sidecar instead of parsing the csv
+            self.assertEqual(read_csv.call_count, 1)
+            self.assertIsInstance(cached.latitudes.base, np.memmap)
+            self.assertEqual(len(index), len(cached))
+            self.assertTupleEqual(index.coordinates("Berlin"), cached.coordinates("berlin"))
+            coordinates = cached.batch_coordinates(["Paris", "Atlantis", "Berlin"])
+            np.testing.assert_allclose(coordinates[[0, 2]], [index.coordinates("Paris"), index.coordinates("Berlin")])
+            self.assertTrue(np.isnan(coordinates[1]).all())
+            with self.assertRaises(KeyError):
+                index.coordinates("Atlantis")
+            # a truncated sidecar is parsed from the csv again and rewritten
+            coordinates_path = CityIndex._sidecar_paths(csv_path)[1]
+            with open(coordinates_path, "r+b") as f:
+                f.truncate(200)
+            with mock.patch.object(pd, "read_csv", wraps=pd.read_csv) as read_csv:
+                reparsed = CityIndex.load(csv_path, sidecar=True)
+                self.assertEqual(read_csv.call_count, 1)
+                self.assertTupleEqual(reparsed.coordinates("Berlin"), index.coordinates("Berlin"))
+                self.assertEqual(len(CityIndex.load(csv_path, sidecar=True)), len(index))
+                self.assertEqual(read_csv.call_count, 1)
+            self.assertListEqual(sorted(os.listdir(directory)),
+                                 ["cities.coordinates.npy", "cities.csv", "cities.names.npy"])
+        finally:
+            shutil.rmtree(directory)
+
     def test_evaluate_game(self):
         test_games = [
             {
@@ -243,13 +447,16 @@ class TestTravelingTourist(unittest.TestCase):
                 "expected_evaluation": 2314.47 + 2851.68 + 2391.61 + 932.37
             }
         ]
-        for game in test_games:
-            self.t = TravelingTourist(
-                possible_moves=[],
-                home_town=game["home_town"],
-                current_game_state=game["current_game_state"]
-            )
-            _assert_almost_equel(self.t.evaluate_game(), game["expected_evaluation"], factor=0.01)
+        # the default haversine distances are computed on a sphere and deviate a bit more
+        for distance_method, factor in [("geodesic", 0.01), ("haversine", 0.02)]:
+            for game in test_games:
+                self.t = TravelingTourist(
+                    possible_moves=[],
+                    home_town=game["home_town"],
+                    current_game_state=game["current_game_state"],
+                    distance_method=distance_method
+                )
+                _assert_almost_equel(self.t.evaluate_game(), game["expected_evaluation"], factor=factor)
 
     def tearDown(self):
         self.t = None